@@ -7,6 +7,7 @@ from typing import Dict, List, Optional, Tuple
 from enum import Enum
 from dataclasses import dataclass, asdict
 import uuid
+from database import json_loads
 
 class SeverityLevel(Enum):
     """MDQ严重程度等级 - 基于标准MDQ评分"""
@@ -456,7 +457,7 @@ class MDQAnalyzer:
             
             # 如果没有raw_score，从test_data计算
             # 这部分需要访问数据库获取完整的test_data
-            test_detail = self.db_manager.get_mdq_test_detail(test['test_id'], test.get('user_id', ''))
+            test_detail = self.db_manager.get_mdq_test_detail(test['test_id'], test.get('user_id', ''), include_ai=False)
             if test_detail and 'test_data' in test_detail:
                 test_data = test_detail['test_data']
                 questions = test_data.get('questions', {})
@@ -1215,7 +1216,7 @@ class MDQAnalyzer:
                 for field in json_fields:
                     if analysis_data.get(field):
                         try:
-                            analysis_data[field] = json.loads(analysis_data[field])
+                            analysis_data[field] = json_loads(analysis_data[field])
                         except json.JSONDecodeError:
                             analysis_data[field] = {}
                 
@@ -1230,6 +1231,71 @@ class MDQAnalyzer:
             if conn:
                 conn.close()
     
+    def get_analysis_bundle(self, analysis_id: str) -> Optional[Dict]:
+        """一次查询同时获取分析详情与AI分析数据
+        
+        返回 {'detail': ..., 'ai_data': ...}，与分别调用 get_analysis_detail 和
+        get_ai_analysis_data 的结果一致；记录不存在时返回 None。
+        """
+        return self._fetch_analysis_bundle('''
+            SELECT * FROM mdq_analysis_results
+            WHERE analysis_id = ?
+        ''', (analysis_id,))
+    
+    def get_latest_analysis_bundle(self, user_id: str) -> Optional[Dict]:
+        """一次查询获取用户最新一次分析的详情与AI分析数据，结构同 get_analysis_bundle"""
+        return self._fetch_analysis_bundle('''
+            SELECT * FROM mdq_analysis_results
+            WHERE user_id = ?
+            ORDER BY analysis_date DESC
+            LIMIT 1
+        ''', (user_id,))
+    
+    def _fetch_analysis_bundle(self, query: str, params: Tuple) -> Optional[Dict]:
+        """执行单行查询，拆分为分析详情与AI分析数据"""
+        conn = None
+        try:
+            conn = self.db_manager._get_connection()
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            result = cursor.fetchone()
+            
+            if not result:
+                return None
+            
+            columns = [description[0] for description in cursor.description]
+            analysis_data = dict(zip(columns, result))
+            
+            ai_data = None
+            if analysis_data.get('ai_analysis_data'):
+                try:
+                    ai_data = json_loads(analysis_data['ai_analysis_data'])
+                except json.JSONDecodeError:
+                    print(f"AI分析数据格式错误: {analysis_data['analysis_id']}")
+                # 详情中的该字段与 get_analysis_detail 一致：解析失败时为空字典
+                analysis_data['ai_analysis_data'] = ai_data if ai_data is not None else {}
+            
+            # 解析其余JSON字段
+            json_fields = ['positive_symptoms', 'symptom_profile', 'recovery_indicators',
+                         'risk_factors', 'treatment_response_indicators',
+                         'clinical_recommendations']
+            
+            for field in json_fields:
+                if analysis_data.get(field):
+                    try:
+                        analysis_data[field] = json_loads(analysis_data[field])
+                    except json.JSONDecodeError:
+                        analysis_data[field] = {}
+            
+            return {'detail': analysis_data, 'ai_data': ai_data}
+        
+        except sqlite3.Error as e:
+            print(f"获取分析数据失败: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+    
     def get_ai_analysis_data(self, analysis_id: str) -> Optional[Dict]:
         """获取AI分析数据"""
         try:
@@ -1245,7 +1311,7 @@ class MDQAnalyzer:
             
             if result and result[0]:
                 try:
-                    return json.loads(result[0])
+                    return json_loads(result[0])
                 except json.JSONDecodeError:
                     print(f"AI分析数据格式错误: {analysis_id}")
                     return None
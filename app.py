@@ -13,6 +13,7 @@ import logging
 from functools import wraps
 import time
 import traceback
+import asyncio
 # 添加 Utils 工具类
 class Utils:
     """Utility class providing common helper functions"""
@@ -197,6 +198,12 @@ def init_components():
 # Initialize components on application startup
 init_components()
 
+@app.teardown_request
+def release_db_connection(exception=None):
+    """Release this thread's pooled connection, rolling back anything a handler left open"""
+    if db_manager:
+        db_manager.release_connection()
+
 # Utility functions
 def allowed_file(filename):
     """Check if file type is allowed"""
@@ -582,38 +589,40 @@ def delete_user_account():
         logger.info(f"收到删除账户请求: 用户 {user_id}")
         
         # 验证密码
-        conn = db_manager._get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT password_hash, salt FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            return jsonify({'success': False, 'message': '用户不存在'}), 404
-        
-        stored_hash, salt = result
-        password_hash, _ = db_manager._hash_password(password, salt)
-        
-        if password_hash != stored_hash:
-            conn.close()
-            return jsonify({'success': False, 'message': '密码错误'}), 401
-        
-        # 软删除账户（标记为不活跃）
-        cursor.execute('''
-            UPDATE users 
-            SET is_active = 0, 
-                email = email || '_deleted_' || ?, 
-                username = username || '_deleted_' || ?
-            WHERE user_id = ?
-        ''', (datetime.now().strftime('%Y%m%d%H%M%S'), 
-              datetime.now().strftime('%Y%m%d%H%M%S'), 
-              user_id))
-        
-        # 删除所有会话
-        cursor.execute('UPDATE user_sessions SET is_active = 0 WHERE user_id = ?', (user_id,))
-        
-        conn.commit()
-        conn.close()
+        conn = None
+        try:
+            conn = db_manager._get_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT password_hash, salt FROM users WHERE user_id = ?', (user_id,))
+            result = cursor.fetchone()
+            
+            if not result:
+                return jsonify({'success': False, 'message': '用户不存在'}), 404
+            
+            stored_hash, salt = result
+            password_hash, _ = db_manager._hash_password(password, salt)
+            
+            if password_hash != stored_hash:
+                return jsonify({'success': False, 'message': '密码错误'}), 401
+            
+            # 软删除账户（标记为不活跃）
+            cursor.execute('''
+                UPDATE users 
+                SET is_active = 0, 
+                    email = email || '_deleted_' || ?, 
+                    username = username || '_deleted_' || ?
+                WHERE user_id = ?
+            ''', (datetime.now().strftime('%Y%m%d%H%M%S'), 
+                  datetime.now().strftime('%Y%m%d%H%M%S'), 
+                  user_id))
+            
+            # 删除所有会话
+            cursor.execute('UPDATE user_sessions SET is_active = 0 WHERE user_id = ?', (user_id,))
+            
+            conn.commit()
+        finally:
+            if conn:
+                conn.close()
         
         # 清除当前会话
         session.clear()
@@ -1182,7 +1191,14 @@ def generate_ai_report():
                 logger.info(f"Starting single test report generation: analysis_id={analysis_id}")
 
                 try:
-                    single_report = advisor.generate_single_test_report(analysis_id)
+                    if report_type == 'both':
+                        # Generate both reports concurrently; a failed one comes back as its exception
+                        single_report, historical_report = asyncio.run(
+                            advisor.agenerate_full_report(user_id, analysis_id))
+                        if isinstance(single_report, Exception):
+                            raise single_report
+                    else:
+                        single_report = advisor.generate_single_test_report(analysis_id)
                     logger.info(f"Single test report generated successfully: report_id={single_report.report_id}")
 
                     # Convert enum objects
@@ -1211,7 +1227,11 @@ def generate_ai_report():
             if report_type in ['historical', 'both']:
                 logger.info("Starting historical trend report generation...")
                 try:
-                    historical_report = advisor.generate_historical_analysis_report(user_id)
+                    if report_type == 'both':
+                        if isinstance(historical_report, Exception):
+                            raise historical_report
+                    else:
+                        historical_report = advisor.generate_historical_analysis_report(user_id)
                     logger.info(f"Historical trend report generated successfully: report_id={historical_report.report_id}")
 
                     # Convert enum objects
@@ -1355,16 +1375,19 @@ def health_check():
         db_status = False
         db_error = None
         if db_manager:
+            conn = None
             try:
                 conn = db_manager._get_connection()
                 cursor = conn.cursor()
                 cursor.execute('SELECT 1')
                 cursor.fetchone()
-                conn.close()
                 db_status = True
             except Exception as e:
                 db_error = str(e)
                 logger.error(f"Database health check failed: {e}")
+            finally:
+                if conn:
+                    conn.close()
 
         # Check advisor API availability
         advisor_status = {
@@ -1527,26 +1550,29 @@ def test_database():
             return jsonify({'success': False, 'message': '数据库管理器未初始化'}), 500
         
         # 测试数据库连接
-        conn = db_manager._get_connection()
-        cursor = conn.cursor()
-        
-        # 检查用户表
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        users_table = cursor.fetchone()
-        
-        # 统计用户数量
-        cursor.execute("SELECT COUNT(*) FROM users")
-        user_count = cursor.fetchone()[0]
-        
-        # 统计测试数量
-        cursor.execute("SELECT COUNT(*) FROM questionnaire_tests")
-        test_count = cursor.fetchone()[0]
-        
-        # 获取最近5个用户
-        cursor.execute("SELECT username, registration_date FROM users ORDER BY registration_date DESC LIMIT 5")
-        recent_users = cursor.fetchall()
-        
-        conn.close()
+        conn = None
+        try:
+            conn = db_manager._get_connection()
+            cursor = conn.cursor()
+            
+            # 检查用户表
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
+            users_table = cursor.fetchone()
+            
+            # 统计用户数量
+            cursor.execute("SELECT COUNT(*) FROM users")
+            user_count = cursor.fetchone()[0]
+            
+            # 统计测试数量
+            cursor.execute("SELECT COUNT(*) FROM questionnaire_tests")
+            test_count = cursor.fetchone()[0]
+            
+            # 获取最近5个用户
+            cursor.execute("SELECT username, registration_date FROM users ORDER BY registration_date DESC LIMIT 5")
+            recent_users = cursor.fetchall()
+        finally:
+            if conn:
+                conn.close()
         
         return jsonify({
             'success': True,
@@ -1620,15 +1646,18 @@ def startup_check():
     
     # 检查数据库
     if db_manager:
+        conn = None
         try:
             conn = db_manager._get_connection()
             cursor = conn.cursor()
             cursor.execute('SELECT COUNT(*) FROM users')
             user_count = cursor.fetchone()[0]
-            conn.close()
             print(f"✅ 数据库连接正常，当前用户数量: {user_count}")
         except Exception as e:
             print(f"❌ 数据库连接失败: {e}")
+        finally:
+            if conn:
+                conn.close()
     else:
         print("❌ 数据库管理器未初始化")
     
@@ -1654,6 +1683,7 @@ def clear_test_progress():
         # 这里可以根据具体需求决定清空哪些数据
         # 例如：清空未完成的测试草稿、临时数据等
         
+        conn = None
         try:
             # 获取数据库连接
             conn = db_manager._get_connection()
@@ -1670,7 +1700,6 @@ def clear_test_progress():
             
             # 提交更改
             conn.commit()
-            conn.close()
             
             logger.info(f"✅ 用户 {user_id} 的测试进度已清空")
             
@@ -1687,6 +1716,9 @@ def clear_test_progress():
                 'success': False,
                 'message': '加载进度时数据库操作失败'
             }), 500
+        finally:
+            if conn:
+                conn.close()
             
     except Exception as e:
         logger.error(f"加载测试进度API异常: {e}")
@@ -1703,6 +1735,7 @@ def check_test_progress():
             
         user_id = session['user_id']
         
+        conn = None
         try:
             # 获取数据库连接
             conn = db_manager._get_connection()
@@ -1716,7 +1749,6 @@ def check_test_progress():
             ''', (user_id,))
             
             result = cursor.fetchone()
-            conn.close()
             
             has_progress = result[0] > 0 if result else False
             last_updated = result[1] if result and result[1] else None
@@ -1734,6 +1766,9 @@ def check_test_progress():
                 'success': False,
                 'message': '检查进度时数据库操作失败'
             }), 500
+        finally:
+            if conn:
+                conn.close()
             
     except Exception as e:
         logger.error(f"检查测试进度API异常: {e}")
@@ -1755,6 +1790,7 @@ def save_test_progress():
             
         logger.info(f"用户 {user_id} 保存测试进度")
         
+        conn = None
         try:
             # 获取数据库连接
             conn = db_manager._get_connection()
@@ -1797,7 +1833,6 @@ def save_test_progress():
                 logger.info(f"✅ 创建用户 {user_id} 的测试进度记录")
             
             conn.commit()
-            conn.close()
             
             return jsonify({
                 'success': True,
@@ -1811,6 +1846,9 @@ def save_test_progress():
                 'success': False,
                 'message': '保存进度时数据库操作失败'
             }), 500
+        finally:
+            if conn:
+                conn.close()
             
     except Exception as e:
         logger.error(f"保存测试进度API异常: {e}")
@@ -1826,6 +1864,7 @@ def load_test_progress():
             
     user_id = session['user_id']
         
+    conn = None
     try:
         # 获取数据库连接
         conn = db_manager._get_connection()
@@ -1841,7 +1880,6 @@ def load_test_progress():
             ''', (user_id,))
             
         result = cursor.fetchone()
-        conn.close()
             
         if result:
             progress_data = json.loads(result[0])
@@ -1860,6 +1898,9 @@ def load_test_progress():
                 
     except Exception as db_error:
         logger.error(f"数据库操作失败: {db_error}")
+    finally:
+        if conn:
+            conn.close()
 # ====== 数据查询API ======
 @app.route('/api/test/history', methods=['GET'])
 @login_required
@@ -1880,7 +1921,7 @@ def get_test_history():
         for test in raw_history:
             try:
                 # 获取测试详情
-                test_detail = db_manager.get_mdq_test_detail(test['test_id'], user_id)
+                test_detail = db_manager.get_mdq_test_detail(test['test_id'], user_id, include_ai=False)
                 
                 if test_detail:
                     test_data = test_detail['test_data']
@@ -2051,7 +2092,7 @@ def get_user_statistics():
         
         for test in all_tests:
             try:
-                test_detail = db_manager.get_mdq_test_detail(test['test_id'], user_id)
+                test_detail = db_manager.get_mdq_test_detail(test['test_id'], user_id, include_ai=False)
                 if test_detail:
                     test_data = test_detail['test_data']
                     questions = test_data.get('questions', {})
@@ -2082,7 +2123,7 @@ def get_user_statistics():
         if all_tests:
             try:
                 latest_test = all_tests[0]
-                latest_detail = db_manager.get_mdq_test_detail(latest_test['test_id'], user_id)
+                latest_detail = db_manager.get_mdq_test_detail(latest_test['test_id'], user_id, include_ai=False)
                 if latest_detail:
                     test_data = latest_detail['test_data']
                     questions = test_data.get('questions', {})
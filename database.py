@@ -2,13 +2,162 @@ import sqlite3
 from datetime import datetime
 import json
 import hashlib
+import secrets
 import uuid
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 import os
+import threading
+import atexit
 import numpy as np
 from enum import Enum
 from dataclasses import dataclass
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(obj) -> str:
+    """序列化为紧凑JSON字符串，可用时使用 orjson"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except TypeError:
+            pass  # orjson 不支持的类型（如超长整数）交给标准库处理
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def json_loads(data):
+    """解析JSON字符串，可用时使用 orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# 标准MDQ-13问题ID（题目固定为13题）
+_Q_IDS: Tuple[str, ...] = ('q1', 'q2', 'q3', 'q4', 'q5', 'q6', 'q7',
+                           'q8', 'q9', 'q10', 'q11', 'q12', 'q13')
+_Q_IDS_SET = frozenset(_Q_IDS)
+
+# MDQ建议模板 (按MDQ结果索引，模块加载时构建一次)
+_MDQ_RECOMMENDATIONS: Dict[str, Dict] = {
+    'positive_high': {
+        'immediate_actions': [
+            '立即进行精神科急诊评估',
+            '考虑住院治疗或危机干预',
+            'MDQ高度阳性，强烈提示双相障碍',
+            '联系紧急联系人'
+        ],
+        'self_care': [
+            '确保个人安全',
+            '避免做重大决定',
+            '监控情绪和行为变化'
+        ],
+        'resources': [
+            '精神科急诊服务',
+            '危机干预热线',
+            '双相障碍专科门诊'
+        ],
+        'follow_up': '需要立即专业干预'
+    },
+    'positive_moderate': {
+        'immediate_actions': [
+            '48-72小时内安排精神科专科评估',
+            'MDQ中度阳性，需要专业评估',
+            '详细的临床访谈和病史收集'
+        ],
+        'self_care': [
+            '保持规律的作息时间',
+            '避免过度刺激和压力',
+            '监控症状变化'
+        ],
+        'resources': [
+            '精神科专科门诊',
+            '心理健康中心',
+            '双相障碍教育资源'
+        ],
+        'follow_up': '建议72小时内寻求专业评估'
+    },
+    'positive_mild': {
+        'immediate_actions': [
+            '1-2周内安排专科咨询',
+            'MDQ轻度阳性，建议进一步评估',
+            '关注症状变化和发展'
+        ],
+        'self_care': [
+            '保持健康的生活方式',
+            '练习压力管理技巧',
+            '记录情绪变化'
+        ],
+        'resources': [
+            '心理健康专家咨询',
+            '情绪管理技巧',
+            '支持小组'
+        ],
+        'follow_up': '建议2周内专科咨询'
+    },
+    'positive_subclinical': {
+        'immediate_actions': [
+            '门诊随访观察',
+            '亚临床阳性，功能损害轻微',
+            '预防性心理干预'
+        ],
+        'self_care': [
+            '保持良好生活习惯',
+            '学习症状识别',
+            '定期自我评估'
+        ],
+        'resources': [
+            '心理健康教育',
+            '预防性咨询',
+            '生活方式指导'
+        ],
+        'follow_up': '定期监测，如症状加重及时就诊'
+    },
+    'negative': {
+        'immediate_actions': [
+            'MDQ筛查阴性，继续关注心理健康',
+            '保持良好的生活习惯'
+        ],
+        'self_care': [
+            '定期运动',
+            '保持社交联系',
+            '练习正念和放松技巧'
+        ],
+        'resources': [
+            '心理健康教育资源',
+            '压力管理工具',
+            '健康生活指南'
+        ],
+        'follow_up': '如症状发生变化，及时寻求帮助'
+    }
+}
+
+# 预序列化的建议JSON，写入时直接使用，避免每次序列化
+_MDQ_RECOMMENDATIONS_JSON: Dict[str, str] = {
+    mdq_result: json_dumps(recommendations)
+    for mdq_result, recommendations in _MDQ_RECOMMENDATIONS.items()
+}
+
+# 功能损害对风险百分比的贡献
+_FUNCTIONAL_RISK: Dict[str, int] = {
+    'no_problems': 0,
+    'minor_problems': 5,
+    'moderate_problems': 15,
+    'serious_problems': 25
+}
+
+# MDQ结果解释模板 (按MDQ结果索引)
+_MDQ_INTERPRETATION_TEMPLATES: Dict[str, str] = {
+    'negative': 'MDQ筛查阴性 (分数: {score}/13)',
+    'positive_subclinical': 'MDQ亚临床阳性 (分数: {score}/13，症状同时出现但功能损害轻微)',
+    'positive_mild': 'MDQ轻度阳性 (分数: {score}/13，轻度功能损害)',
+    'positive_moderate': 'MDQ中度阳性 (分数: {score}/13，中等功能损害)',
+    'positive_high': 'MDQ高度阳性 (分数: {score}/13，严重功能损害)'
+}
+_MDQ_INTERPRETATION_DEFAULT = 'MDQ评估结果 (分数: {score}/13)'
+
 # 更新为标准MDQ严重程度等级
 class SeverityLevel(Enum):
     """MDQ严重程度等级 - 基于标准MDQ评分"""
@@ -69,12 +218,153 @@ class AnalysisResult:
     emergency_flag: bool
     next_assessment_date: datetime
 
+# 生成器/协程帧在挂起时不在调用栈上，但仍可能持有连接
+class _PooledConnection(sqlite3.Connection):
+    """线程内复用的SQLite连接
+    
+    _get_connection() 每次签出计数加一，close() 仅归还连接并减一：
+    最后一次签出归还时回滚未提交的事务，连接本身保持打开，需要真正关闭时调用 dispose()。
+    调用方漏掉 close() 时计数无法归零，由 reset() 在请求结束等边界处清零并回滚。
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._checkout_depth = 0
+    
+    def _checkout(self):
+        self._checkout_depth += 1
+    
+    def close(self):
+        if self._checkout_depth > 0:
+            self._checkout_depth -= 1
+        if self._checkout_depth == 0 and self.in_transaction:
+            self.rollback()
+    
+    def reset(self):
+        """清零签出计数并回滚遗留的事务"""
+        self._checkout_depth = 0
+        if self.in_transaction:
+            self.rollback()
+    
+    def dispose(self):
+        self._checkout_depth = 0
+        super().close()
+
 class DatabaseManager:
     """数据库管理类 - 适配标准MDQ评分"""
     
+    # ==================== 常用查询语句 ====================
+    # 查询语句作为类常量复用，配合连接的语句缓存避免重复编译
+    
+    # MDQ测试历史
+    _SQL_MDQ_HISTORY = '''
+        SELECT test_id, test_timestamp, 
+               COALESCE(mdq_score, raw_score) AS mdq_score,
+               COALESCE(mdq_score, raw_score) AS raw_score,
+               interpretation, severity_level, completion_time
+        FROM questionnaire_tests 
+        WHERE user_id = ? AND questionnaire_type = 'MDQ'
+        ORDER BY test_timestamp DESC
+        LIMIT ?
+    '''
+    
+    # MDQ测试详情
+    _SQL_MDQ_DETAIL = '''
+        SELECT test_data, test_timestamp, COALESCE(mdq_score, raw_score) AS score,
+            interpretation, severity_level, ai_analysis_data
+        FROM questionnaire_tests 
+        WHERE test_id = ? AND user_id = ? AND questionnaire_type = 'MDQ'
+    '''
+    
+    # MDQ测试详情（不读取AI分析数据）
+    _SQL_MDQ_DETAIL_NO_AI = '''
+        SELECT test_data, test_timestamp, COALESCE(mdq_score, raw_score) AS score,
+            interpretation, severity_level
+        FROM questionnaire_tests 
+        WHERE test_id = ? AND user_id = ? AND questionnaire_type = 'MDQ'
+    '''
+    
+    # 测试建议
+    _SQL_TEST_RECOMMENDATIONS = '''
+        SELECT recommendation_id, recommendations, severity_level, 
+               generation_date, follow_up_date
+        FROM test_recommendations
+        WHERE test_id = ? AND user_id = ?
+        ORDER BY generation_date DESC
+    '''
+    
+    # 用户统计（计数、平均分、阳性数及最近一次测试）
+    _SQL_USER_STATISTICS = '''
+        SELECT agg.total_tests, agg.avg_score, agg.positive_tests,
+               latest.score, latest.severity_level, latest.test_timestamp
+        FROM (
+            SELECT COUNT(*) AS total_tests,
+                   AVG(COALESCE(mdq_score, raw_score)) AS avg_score,
+                   COUNT(CASE WHEN COALESCE(mdq_score, raw_score) >= 7 THEN 1 END) AS positive_tests
+            FROM questionnaire_tests 
+            WHERE user_id = :user_id AND questionnaire_type = 'MDQ'
+        ) AS agg
+        LEFT JOIN (
+            SELECT COALESCE(mdq_score, raw_score) AS score, severity_level, test_timestamp
+            FROM questionnaire_tests 
+            WHERE user_id = :user_id AND questionnaire_type = 'MDQ'
+            ORDER BY test_timestamp DESC
+            LIMIT 1
+        ) AS latest ON 1
+    '''
+    
+    # 测试分析数据
+    _SQL_TEST_ANALYSIS_DATA = '''
+        SELECT ai_analysis_data, COALESCE(mdq_score, raw_score) AS score, raw_score,
+               severity_level, test_timestamp
+        FROM questionnaire_tests 
+        WHERE test_id = ? AND user_id = ? AND questionnaire_type = 'MDQ'
+    '''
+    
+    # 用户资料及测试统计（一次查询，COALESCE 后的分数只计算一次）
+    _SQL_USER_PROFILE_WITH_STATS = '''
+        SELECT u.username, u.email, u.full_name, u.gender, u.age, u.phone,
+            u.occupation, u.education_level, u.emergency_contact,
+            u.registration_date, u.last_login, u.is_active,
+            t.total_tests, t.completed_tests, t.avg_score, t.positive_tests, t.last_test_date
+        FROM users AS u
+        JOIN (
+            SELECT COUNT(*) AS total_tests,
+                   COUNT(score) AS completed_tests,
+                   AVG(score) AS avg_score,
+                   COALESCE(SUM(score >= 7), 0) AS positive_tests,
+                   MAX(test_timestamp) AS last_test_date
+            FROM (
+                SELECT COALESCE(mdq_score, raw_score) AS score, test_timestamp
+                FROM questionnaire_tests 
+                WHERE user_id = :user_id AND questionnaire_type = 'MDQ'
+            )
+        ) AS t
+        WHERE u.user_id = :user_id AND u.is_active = 1
+    '''
+    
+    # 用户测试活动
+    _SQL_ACTIVITY_LOG = '''
+        SELECT 
+            'test_completed' as activity_type,
+            test_timestamp as activity_date,
+            'MDQ测试' as activity_description,
+            COALESCE(mdq_score, raw_score) as score,
+            severity_level
+        FROM questionnaire_tests 
+        WHERE user_id = ? AND questionnaire_type = 'MDQ'
+        ORDER BY test_timestamp DESC
+        LIMIT ?
+    '''
+    
     def __init__(self, db_path="mental_health_assessment.db"):
         self.db_path = db_path
         
+        # 每个线程缓存一个长连接，避免每次调用都重新打开数据库
+        self._tls = threading.local()
+        # 退出时关闭主线程连接
+        atexit.register(self.dispose_connection)
+        
         # MDQ问题描述 (基于标准MDQ-13)
         self.symptom_descriptions = {
             'q1': '情绪异常高涨、兴奋或精力充沛',
@@ -95,6 +385,9 @@ class DatabaseManager:
         # 核心躁狂症状（MDQ诊断关键症状）
         self.core_symptoms = ['q1', 'q2', 'q3', 'q4', 'q5', 'q6', 'q7']
         
+        # 核心症状集合缓存，用于症状分析的集合运算
+        self._core_symptoms_set = frozenset(self.core_symptoms)
+        
         # 功能损害级别映射
         self.functional_impact_mapping = {
             'no': 'no_problems',
@@ -110,8 +403,23 @@ class DatabaseManager:
             'high_specificity': 9,  # 高特异性阈值
         }
         
+        # 评分查找表：(分数, 症状共现, 功能损害) -> (MDQ结果, 严重程度, 风险百分比)
+        self._score_table = self._build_score_table()
+        
         self.init_database()
     
+    def _build_score_table(self) -> Dict[Tuple[int, bool, str], Tuple[str, str, float]]:
+        """预先计算全部输入组合（14×2×4）的评分结果，严重程度以字符串存储"""
+        table = {}
+        for mdq_score in range(len(_Q_IDS) + 1):
+            for has_co_occurrence in (False, True):
+                for functional_impact_level in self.functional_impact_mapping.values():
+                    mdq_result = self._determine_mdq_result_standard(mdq_score, has_co_occurrence, functional_impact_level)
+                    severity_level = self._determine_severity_level_standard(mdq_score, has_co_occurrence, functional_impact_level, mdq_result)
+                    risk_percentage = self._calculate_risk_percentage_standard(mdq_score, has_co_occurrence, functional_impact_level)
+                    table[(mdq_score, has_co_occurrence, functional_impact_level)] = (mdq_result, severity_level.value, risk_percentage)
+        return table
+    
     def init_database(self):
         """初始化数据库和表结构"""
         try:
@@ -215,6 +523,9 @@ class DatabaseManager:
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_email ON users(email)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_sessions ON user_sessions(user_id, is_active)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_mdq_score ON questionnaire_tests(mdq_score)')
+            # 复合索引：按用户+问卷类型过滤并按时间倒序，历史/统计查询无需额外排序
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_qt_user_type_ts ON questionnaire_tests(user_id, questionnaire_type, test_timestamp DESC)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tr_test_user ON test_recommendations(test_id, user_id, generation_date DESC)')
             
             conn.commit()
             print("数据库表结构初始化完成")
@@ -241,14 +552,48 @@ class DatabaseManager:
         return password_hash, salt
     
     def _get_connection(self):
-        """获取数据库连接"""
-        try:
-            conn = sqlite3.connect(self.db_path, timeout=30.0)
-            conn.execute('PRAGMA journal_mode=WAL')  # 启用WAL模式提高并发性能
-            return conn
-        except sqlite3.Error as e:
-            print(f"数据库连接失败: {e}")
-            raise e
+        """获取当前线程的数据库连接
+        
+        连接在线程内复用，调用方仍按原方式 close() 归还；
+        fork 后的子进程会重新建立连接。
+        """
+        tls = self._tls
+        conn = getattr(tls, 'conn', None)
+        if conn is None or tls.pid != os.getpid():
+            try:
+                conn = sqlite3.connect(self.db_path, timeout=30.0, factory=_PooledConnection,
+                                       cached_statements=256)
+                # 以下PRAGMA每个连接只设置一次
+                journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]  # 启用WAL模式，读写互不阻塞
+                if journal_mode.lower() != 'wal':
+                    # 只读目录、内存库或不支持共享内存的文件系统会保留原日志模式
+                    print(f"警告：无法启用WAL模式，当前日志模式为 {journal_mode}")
+                conn.execute('PRAGMA synchronous=NORMAL')  # WAL模式下仅在检查点时fsync
+                conn.execute('PRAGMA wal_autocheckpoint=1000')  # 约每1000页做一次检查点
+                conn.execute('PRAGMA cache_size=-131072')  # 页缓存上限约128MB
+                conn.execute('PRAGMA mmap_size=268435456')  # 256MB内存映射读取
+                conn.execute('PRAGMA temp_store=MEMORY')
+            except sqlite3.Error as e:
+                print(f"数据库连接失败: {e}")
+                raise e
+            tls.conn = conn
+            tls.pid = os.getpid()
+        conn._checkout()
+        return conn
+    
+    def release_connection(self):
+        """归还当前线程连接的全部签出并回滚遗留事务（如每个请求结束时调用）"""
+        conn = getattr(self._tls, 'conn', None)
+        if conn is not None and self._tls.pid == os.getpid():
+            conn.reset()
+    
+    def dispose_connection(self):
+        """关闭当前线程缓存的数据库连接"""
+        conn = getattr(self._tls, 'conn', None)
+        if conn is not None:
+            self._tls.conn = None
+            if self._tls.pid == os.getpid():
+                conn.dispose()
     
     # ==================== 用户注册和登录功能 ====================
     
@@ -631,11 +976,10 @@ class DatabaseManager:
             score_result = self._calculate_mdq_score_standard(test_data)
             print(f"标准MDQ评分结果: {score_result}")
             
-            # 确保 severity_level 是字符串格式
-            severity_level_str = score_result['severity_level'].value if hasattr(score_result['severity_level'], 'value') else str(score_result['severity_level'])
+            severity_level_str = score_result['severity_level']
             
             # 确保 interpretation 是字符串格式
-            interpretation_str = json.dumps(score_result['interpretation']) if isinstance(score_result['interpretation'], list) else str(score_result['interpretation'])
+            interpretation_str = json_dumps(score_result['interpretation']) if isinstance(score_result['interpretation'], list) else str(score_result['interpretation'])
             
             # 执行详细分析
             current_state = self._analyze_current_state_standard(test_data)
@@ -656,7 +1000,7 @@ class DatabaseManager:
             }
             
             # 将AI分析数据序列化为JSON
-            ai_analysis_json = json.dumps(ai_analysis_data)
+            ai_analysis_json = json_dumps(ai_analysis_data)
             
             cursor.execute('''
                 INSERT INTO questionnaire_tests 
@@ -667,7 +1011,7 @@ class DatabaseManager:
                 test_id,
                 user_id,
                 'MDQ',
-                json.dumps(test_data),
+                json_dumps(test_data),
                 score_result['mdq_score'],  # 标准MDQ分数 (0-13)
                 score_result['mdq_score'],  # 兼容性：raw_score = mdq_score
                 interpretation_str,
@@ -676,10 +1020,10 @@ class DatabaseManager:
                 ai_analysis_json
             ))
             
-            conn.commit()
+            # 生成建议（与测试记录共用同一事务，只提交一次）
+            self._generate_mdq_recommendations_standard(test_id, user_id, score_result, conn=conn)
             
-            # 生成建议
-            self._generate_mdq_recommendations_standard(test_id, user_id, score_result)
+            conn.commit()
             
             # 返回更完整的结果，包含分析数据
             return {
@@ -712,7 +1056,7 @@ class DatabaseManager:
         mdq_score = 0
         
         # 标准MDQ评分：只有"no"为0分，其他都为1分
-        for q_id in [f'q{i}' for i in range(1, 14)]:
+        for q_id in _Q_IDS:
             answer = questions.get(q_id, 'no')
             if answer != 'no':
                 mdq_score += 1
@@ -725,14 +1069,10 @@ class DatabaseManager:
         severity = test_data.get('severity', 'no')
         functional_impact_level = self.functional_impact_mapping.get(severity, 'no_problems')
         
-        # MDQ结果判定
-        mdq_result = self._determine_mdq_result_standard(mdq_score, has_co_occurrence, functional_impact_level)
-        
-        # 严重程度评估
-        severity_level = self._determine_severity_level_standard(mdq_score, has_co_occurrence, functional_impact_level, mdq_result)
-        
-        # 风险百分比计算
-        risk_percentage = self._calculate_risk_percentage_standard(mdq_score, has_co_occurrence, functional_impact_level)
+        # MDQ结果判定、严重程度评估及风险百分比（查表）
+        mdq_result, severity_level, risk_percentage = self._score_table[
+            (mdq_score, has_co_occurrence, functional_impact_level)
+        ]
         
         # 生成解释
         interpretation = self._generate_mdq_interpretation_standard(mdq_result, mdq_score, has_co_occurrence, functional_impact_level)
@@ -810,12 +1150,7 @@ class DatabaseManager:
         co_occurrence_risk = 20 if has_co_occurrence else 0
         
         # 功能损害贡献
-        functional_risk = {
-            'no_problems': 0,
-            'minor_problems': 5,
-            'moderate_problems': 15,
-            'serious_problems': 25
-        }.get(functional_impact_level, 0)
+        functional_risk = _FUNCTIONAL_RISK.get(functional_impact_level, 0)
         
         # 综合风险计算
         total_risk = base_risk + score_risk + co_occurrence_risk + functional_risk
@@ -830,37 +1165,26 @@ class DatabaseManager:
                                             has_co_occurrence: bool, functional_impact_level: str) -> str:
         """生成MDQ解释"""
         
-        interpretation_map = {
-            'negative': f'MDQ筛查阴性 (分数: {mdq_score}/13)',
-            'positive_subclinical': f'MDQ亚临床阳性 (分数: {mdq_score}/13，症状同时出现但功能损害轻微)',
-            'positive_mild': f'MDQ轻度阳性 (分数: {mdq_score}/13，轻度功能损害)',
-            'positive_moderate': f'MDQ中度阳性 (分数: {mdq_score}/13，中等功能损害)',
-            'positive_high': f'MDQ高度阳性 (分数: {mdq_score}/13，严重功能损害)'
-        }
+        try:
+            template = _MDQ_INTERPRETATION_TEMPLATES[mdq_result]
+        except KeyError:
+            template = _MDQ_INTERPRETATION_DEFAULT
         
-        return interpretation_map.get(mdq_result, f'MDQ评估结果 (分数: {mdq_score}/13)')
+        return template.format(score=mdq_score)
     
     def _analyze_current_state_standard(self, test_data: Dict) -> Dict:
         """分析当前状态 - 标准MDQ版本"""
         questions = test_data.get('questions', {})
         
         # 第一部分：计算症状分数和症状档案
-        mdq_score = 0
-        symptom_profile = {}
-        positive_symptoms = []
-        
-        for q_id in [f'q{i}' for i in range(1, 14)]:
-            answer = questions.get(q_id, 'no')
-            
-            if answer != 'no':
-                mdq_score += 1
-                symptom_profile[q_id] = True
-                positive_symptoms.append(self.symptom_descriptions[q_id])
-            else:
-                symptom_profile[q_id] = False
+        positive_ids = {q_id for q_id, answer in questions.items()
+                        if answer != 'no' and q_id in _Q_IDS_SET}
+        mdq_score = len(positive_ids)
+        symptom_profile = {q_id: q_id in positive_ids for q_id in _Q_IDS}
+        positive_symptoms = [self.symptom_descriptions[q_id] for q_id in _Q_IDS if q_id in positive_ids]
         
         # 核心症状计数
-        core_symptoms_count = sum(1 for q_id in self.core_symptoms if symptom_profile.get(q_id, False))
+        core_symptoms_count = len(positive_ids & self._core_symptoms_set)
         
         # 第二部分：症状共现性
         co_occurrence = test_data.get('co_occurrence', 'no')
@@ -870,14 +1194,10 @@ class DatabaseManager:
         severity = test_data.get('severity', 'no')
         functional_impact_level = self.functional_impact_mapping.get(severity, 'no_problems')
         
-        # MDQ结果判定
-        mdq_result = self._determine_mdq_result_standard(mdq_score, has_co_occurrence, functional_impact_level)
-        
-        # 严重程度评估
-        severity_level = self._determine_severity_level_standard(mdq_score, has_co_occurrence, functional_impact_level, mdq_result)
-        
-        # 风险百分比计算
-        risk_percentage = self._calculate_risk_percentage_standard(mdq_score, has_co_occurrence, functional_impact_level)
+        # MDQ结果判定、严重程度评估及风险百分比（查表）
+        mdq_result, severity_level, risk_percentage = self._score_table[
+            (mdq_score, has_co_occurrence, functional_impact_level)
+        ]
         
         return {
             'mdq_part1_score': mdq_score,
@@ -891,205 +1211,123 @@ class DatabaseManager:
             'core_symptoms_count': core_symptoms_count
         }
     
-    def _generate_mdq_recommendations_standard(self, test_id: str, user_id: str, score_result: Dict):
-        """生成MDQ建议 - 标准版本"""
-        conn = None
+    def _generate_mdq_recommendations_standard(self, test_id: str, user_id: str, score_result: Dict, conn=None):
+        """生成MDQ建议 - 标准版本（单条记录，委托给批量写入）"""
+        self._generate_mdq_recommendations_batch([(test_id, user_id, score_result)], conn=conn)
+    
+    def _generate_mdq_recommendations_batch(self, items: List[Tuple[str, str, Dict]], conn=None) -> int:
+        """批量生成MDQ建议 - 单事务 executemany 写入
+        
+        传入 conn 时复用调用方的事务，由调用方负责提交；
+        否则自行打开连接，以 BEGIN IMMEDIATE 包裹全部插入后一次提交。
+        """
+        if not items:
+            return 0
+        
+        owns_conn = conn is None
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            recommendation_id = str(uuid.uuid4())
-            mdq_result = score_result['mdq_result']
-            mdq_score = score_result['mdq_score']
-            
-            # 根据MDQ结果生成不同的建议
-            if mdq_result == 'positive_high':
-                recommendations = {
-                    'immediate_actions': [
-                        '立即进行精神科急诊评估',
-                        '考虑住院治疗或危机干预',
-                        'MDQ高度阳性，强烈提示双相障碍',
-                        '联系紧急联系人'
-                    ],
-                    'self_care': [
-                        '确保个人安全',
-                        '避免做重大决定',
-                        '监控情绪和行为变化'
-                    ],
-                    'resources': [
-                        '精神科急诊服务',
-                        '危机干预热线',
-                        '双相障碍专科门诊'
-                    ],
-                    'follow_up': '需要立即专业干预'
-                }
-            elif mdq_result == 'positive_moderate':
-                recommendations = {
-                    'immediate_actions': [
-                        '48-72小时内安排精神科专科评估',
-                        'MDQ中度阳性，需要专业评估',
-                        '详细的临床访谈和病史收集'
-                    ],
-                    'self_care': [
-                        '保持规律的作息时间',
-                        '避免过度刺激和压力',
-                        '监控症状变化'
-                    ],
-                    'resources': [
-                        '精神科专科门诊',
-                        '心理健康中心',
-                        '双相障碍教育资源'
-                    ],
-                    'follow_up': '建议72小时内寻求专业评估'
-                }
-            elif mdq_result == 'positive_mild':
-                recommendations = {
-                    'immediate_actions': [
-                        '1-2周内安排专科咨询',
-                        'MDQ轻度阳性，建议进一步评估',
-                        '关注症状变化和发展'
-                    ],
-                    'self_care': [
-                        '保持健康的生活方式',
-                        '练习压力管理技巧',
-                        '记录情绪变化'
-                    ],
-                    'resources': [
-                        '心理健康专家咨询',
-                        '情绪管理技巧',
-                        '支持小组'
-                    ],
-                    'follow_up': '建议2周内专科咨询'
-                }
-            elif mdq_result == 'positive_subclinical':
-                recommendations = {
-                    'immediate_actions': [
-                        '门诊随访观察',
-                        '亚临床阳性，功能损害轻微',
-                        '预防性心理干预'
-                    ],
-                    'self_care': [
-                        '保持良好生活习惯',
-                        '学习症状识别',
-                        '定期自我评估'
-                    ],
-                    'resources': [
-                        '心理健康教育',
-                        '预防性咨询',
-                        '生活方式指导'
-                    ],
-                    'follow_up': '定期监测，如症状加重及时就诊'
-                }
-            else:  # negative
-                recommendations = {
-                    'immediate_actions': [
-                        'MDQ筛查阴性，继续关注心理健康',
-                        '保持良好的生活习惯'
-                    ],
-                    'self_care': [
-                        '定期运动',
-                        '保持社交联系',
-                        '练习正念和放松技巧'
-                    ],
-                    'resources': [
-                        '心理健康教育资源',
-                        '压力管理工具',
-                        '健康生活指南'
-                    ],
-                    'follow_up': '如症状发生变化，及时寻求帮助'
-                }
+            if owns_conn:
+                conn = self._get_connection()
+                conn.execute('BEGIN IMMEDIATE')
             
-            # 获取严重程度字符串
-            severity_level_str = score_result['severity_level'].value if hasattr(score_result['severity_level'], 'value') else str(score_result['severity_level'])
+            # 一次性取出整批ID所需的随机字节，按32位十六进制切分
+            id_pool = secrets.token_hex(16 * len(items))
             
-            cursor.execute('''
+            rows = []
+            for index, (test_id, user_id, score_result) in enumerate(items):
+                recommendations_json = _MDQ_RECOMMENDATIONS_JSON.get(
+                    score_result['mdq_result'], _MDQ_RECOMMENDATIONS_JSON['negative']
+                )
+                
+                rows.append((
+                    id_pool[index * 32:(index + 1) * 32],
+                    test_id,
+                    user_id,
+                    recommendations_json,
+                    score_result['severity_level']
+                ))
+            
+            conn.executemany('''
                 INSERT INTO test_recommendations 
                 (recommendation_id, test_id, user_id, recommendations, severity_level)
                 VALUES (?, ?, ?, ?, ?)
-            ''', (
-                recommendation_id,
-                test_id,
-                user_id,
-                json.dumps(recommendations),
-                severity_level_str
-            ))
+            ''', rows)
             
-            conn.commit()
+            if owns_conn:
+                conn.commit()
+            return len(rows)
             
         except sqlite3.Error as e:
             print(f"生成建议失败: {e}")
+            if owns_conn and conn:
+                conn.rollback()
+            return 0
         finally:
-            if conn:
+            if owns_conn and conn:
                 conn.close()
     
-    def get_user_mdq_history(self, user_id: str, limit: int = 10) -> List[Dict]:
-        """获取用户的MDQ测试历史"""
+    def iter_user_mdq_history(self, user_id: str, limit: int = 10) -> Iterator[Dict]:
+        """逐条产出用户的MDQ测试历史
+        
+        迭代结束（或生成器被回收）时归还连接，数据库错误直接抛出。
+        """
         conn = None
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
-            cursor.execute('''
-                SELECT test_id, test_timestamp, mdq_score, raw_score, interpretation, 
-                        severity_level, completion_time
-                FROM questionnaire_tests 
-                WHERE user_id = ? AND questionnaire_type = 'MDQ'
-                ORDER BY test_timestamp DESC
-                LIMIT ?
-            ''', (user_id, limit))
-            
-            tests = cursor.fetchall()
-            
-            return [{
-                'test_id': row[0],
-                'test_timestamp': row[1],
-                'mdq_score': row[2] if row[2] is not None else row[3],  # 优先使用mdq_score
-                'raw_score': row[2] if row[2] is not None else row[3],  # **修复：raw_score应该与mdq_score保持一致**
-                'interpretation': row[4],
-                'severity_level': row[5],
-                'completion_time': row[6]
-            } for row in tests]
+            # 列别名与返回字段一致，优先使用mdq_score，raw_score与mdq_score保持一致
+            cursor.execute(self._SQL_MDQ_HISTORY, (user_id, limit))
             
-        except sqlite3.Error as e:
-            print(f"获取MDQ历史失败: {e}")
-            return []
+            for row in cursor:
+                yield dict(row)
         finally:
             if conn:
                 conn.close()
     
-    def get_mdq_test_detail(self, test_id: str, user_id: str) -> Optional[Dict]:
-        """获取MDQ测试详细信息"""
+    def get_user_mdq_history(self, user_id: str, limit: int = 10) -> List[Dict]:
+        """获取用户的MDQ测试历史"""
+        try:
+            return list(self.iter_user_mdq_history(user_id, limit))
+        except sqlite3.Error as e:
+            print(f"获取MDQ历史失败: {e}")
+            return []
+    
+    def get_mdq_test_detail(self, test_id: str, user_id: str, include_ai: bool = True) -> Optional[Dict]:
+        """获取MDQ测试详细信息
+        
+        include_ai 为 False 时不读取也不解析 ai_analysis_data，结果中不含该字段。
+        """
         conn = None
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute('''
-                SELECT test_data, test_timestamp, mdq_score, raw_score, interpretation, 
-                    severity_level, ai_analysis_data
-                FROM questionnaire_tests 
-                WHERE test_id = ? AND user_id = ? AND questionnaire_type = 'MDQ'
-            ''', (test_id, user_id))
+            cursor.execute(self._SQL_MDQ_DETAIL if include_ai else self._SQL_MDQ_DETAIL_NO_AI, (test_id, user_id))
             
             result = cursor.fetchone()
             
             if result:
                 # **修复：确保分数字段的一致性**
-                mdq_score = result[2] if result[2] is not None else result[3]
+                mdq_score = result[2]
                 
                 detail = {
-                    'test_data': json.loads(result[0]),
+                    'test_data': json_loads(result[0]),
                     'test_timestamp': result[1],
                     'mdq_score': mdq_score,
                     'raw_score': mdq_score,  # **修复：raw_score应该与mdq_score保持一致**
-                    'interpretation': result[4],
-                    'severity_level': result[5],
+                    'interpretation': result[3],
+                    'severity_level': result[4],
                 }
                 
+                if not include_ai:
+                    return detail
+                
                 # 包含AI分析数据
-                if result[6]:  # ai_analysis_data
+                if result[5]:  # ai_analysis_data
                     try:
-                        ai_data = json.loads(result[6])
+                        ai_data = json_loads(result[5])
                         # **修复：确保AI分析数据中的分数字段一致**
                         ai_data['raw_score'] = mdq_score
                         detail['ai_analysis_data'] = ai_data
@@ -1116,24 +1354,16 @@ class DatabaseManager:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
-            cursor.execute('''
-                SELECT recommendation_id, recommendations, severity_level, 
-                       generation_date, follow_up_date
-                FROM test_recommendations
-                WHERE test_id = ? AND user_id = ?
-                ORDER BY generation_date DESC
-            ''', (test_id, user_id))
-            
-            recommendations = cursor.fetchall()
-            
-            return [{
-                'recommendation_id': row[0],
-                'recommendations': json.loads(row[1]),
-                'severity_level': row[2],
-                'generation_date': row[3],
-                'follow_up_date': row[4]
-            } for row in recommendations]
+            cursor.execute(self._SQL_TEST_RECOMMENDATIONS, (test_id, user_id))
+            
+            recommendations = []
+            for row in cursor.fetchall():
+                recommendation = dict(row)
+                recommendation['recommendations'] = json_loads(row['recommendations'])
+                recommendations.append(recommendation)
+            return recommendations
             
         except sqlite3.Error as e:
             print(f"获取测试建议失败: {e}")
@@ -1149,42 +1379,10 @@ class DatabaseManager:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            # 获取测试总数
-            cursor.execute('''
-                SELECT COUNT(*) FROM questionnaire_tests 
-                WHERE user_id = ? AND questionnaire_type = 'MDQ'
-            ''', (user_id,))
-            total_tests = cursor.fetchone()[0]
-            
-            # 获取最近的测试结果
-            cursor.execute('''
-                SELECT mdq_score, raw_score, severity_level, test_timestamp
-                FROM questionnaire_tests 
-                WHERE user_id = ? AND questionnaire_type = 'MDQ'
-                ORDER BY test_timestamp DESC
-                LIMIT 1
-            ''', (user_id,))
-            latest_test = cursor.fetchone()
-            
-            # 获取平均得分
-            cursor.execute('''
-                SELECT AVG(COALESCE(mdq_score, raw_score)) FROM questionnaire_tests 
-                WHERE user_id = ? AND questionnaire_type = 'MDQ'
-            ''', (user_id,))
-            avg_score = cursor.fetchone()[0]
-            
-            # 获取阳性结果统计
-            cursor.execute('''
-                SELECT COUNT(*) FROM questionnaire_tests 
-                WHERE user_id = ? AND questionnaire_type = 'MDQ' 
-                AND COALESCE(mdq_score, raw_score) >= 7
-            ''', (user_id,))
-            positive_tests = cursor.fetchone()[0]
-            
-            # **修复：确保latest_test中的分数字段一致**
-            latest_score = None
-            if latest_test:
-                latest_score = latest_test[0] if latest_test[0] is not None else latest_test[1]
+            # 单次查询完成计数、平均分、阳性统计及最近一次测试
+            cursor.execute(self._SQL_USER_STATISTICS, {'user_id': user_id})
+            total_tests, avg_score, positive_tests, latest_score, latest_severity, latest_date = cursor.fetchone()
+            has_latest = total_tests > 0
             
             return {
                 'total_tests': total_tests,
@@ -1194,9 +1392,9 @@ class DatabaseManager:
                 'latest_test': {
                     'mdq_score': latest_score,
                     'raw_score': latest_score,  # **修复：保持一致性**
-                    'severity_level': latest_test[2] if latest_test else None,
-                    'date': latest_test[3] if latest_test else None
-                } if latest_test else None,
+                    'severity_level': latest_severity,
+                    'date': latest_date
+                } if has_latest else None,
                 'average_mdq_score': round(avg_score, 2) if avg_score else 0,
                 'screening_threshold': 7,  # MDQ筛查阈值
                 'max_possible_score': 13   # MDQ最高分
@@ -1216,19 +1414,15 @@ class DatabaseManager:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute('''
-                SELECT ai_analysis_data, mdq_score, raw_score, severity_level, test_timestamp
-                FROM questionnaire_tests 
-                WHERE test_id = ? AND user_id = ? AND questionnaire_type = 'MDQ'
-            ''', (test_id, user_id))
+            cursor.execute(self._SQL_TEST_ANALYSIS_DATA, (test_id, user_id))
             
             result = cursor.fetchone()
             
             if result and result[0]:  # 如果有AI分析数据
                 try:
-                    analysis_data = json.loads(result[0])
+                    analysis_data = json_loads(result[0])
                     analysis_data.update({
-                        'mdq_score': result[1] if result[1] is not None else result[2],
+                        'mdq_score': result[1],
                         'raw_score': result[2],  # 保留兼容性
                         'severity_level': result[3],
                         'test_timestamp': result[4]
@@ -1256,14 +1450,8 @@ class DatabaseManager:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            # 获取用户基本信息
-            cursor.execute('''
-                SELECT username, email, full_name, gender, age, phone, 
-                    occupation, education_level, emergency_contact,
-                    registration_date, last_login, is_active
-                FROM users 
-                WHERE user_id = ? AND is_active = 1
-            ''', (user_id,))
+            # 用户基本信息与测试统计一次取回
+            cursor.execute(self._SQL_USER_PROFILE_WITH_STATS, {'user_id': user_id})
             
             result = cursor.fetchone()
             
@@ -1286,28 +1474,16 @@ class DatabaseManager:
                 'is_active': result[11]
             }
             
-            # 获取测试统计
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_tests,
-                    COUNT(CASE WHEN COALESCE(mdq_score, raw_score) IS NOT NULL THEN 1 END) as completed_tests,
-                    AVG(CASE WHEN COALESCE(mdq_score, raw_score) IS NOT NULL THEN COALESCE(mdq_score, raw_score) END) as avg_score,
-                    COUNT(CASE WHEN COALESCE(mdq_score, raw_score) >= 7 THEN 1 END) as positive_tests,
-                    MAX(test_timestamp) as last_test_date
-                FROM questionnaire_tests 
-                WHERE user_id = ? AND questionnaire_type = 'MDQ'
-            ''', (user_id,))
-            
-            stats = cursor.fetchone()
+            total_tests, completed_tests, avg_score, positive_tests, last_test_date = result[12:]
             
             profile['statistics'] = {
-                'total_tests': stats[0] if stats else 0,
-                'completed_tests': stats[1] if stats else 0,
-                'incomplete_tests': (stats[0] - stats[1]) if stats and stats[1] else 0,
-                'average_mdq_score': round(stats[2], 1) if stats and stats[2] else 0,
-                'positive_tests': stats[3] if stats else 0,
-                'positive_rate': round((stats[3] / stats[1]) * 100, 1) if stats and stats[1] > 0 else 0,
-                'last_test_date': stats[4] if stats else None,
+                'total_tests': total_tests,
+                'completed_tests': completed_tests,
+                'incomplete_tests': (total_tests - completed_tests) if completed_tests else 0,
+                'average_mdq_score': round(avg_score, 1) if avg_score else 0,
+                'positive_tests': positive_tests,
+                'positive_rate': round((positive_tests / completed_tests) * 100, 1) if completed_tests > 0 else 0,
+                'last_test_date': last_test_date,
                 'screening_threshold': 7,
                 'max_possible_score': 13
             }
@@ -1344,109 +1520,184 @@ class DatabaseManager:
             if conn:
                 conn.close()
 
-    def get_user_activity_log(self, user_id: str, limit: int = 20) -> List[Dict]:
-        """获取用户活动日志"""
+    def iter_user_activity_log(self, user_id: str, limit: int = 20) -> Iterator[Dict]:
+        """逐条产出用户活动日志
+        
+        迭代结束（或生成器被回收）时归还连接，数据库错误直接抛出。
+        """
         conn = None
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
                 
             # 获取测试活动
-            cursor.execute('''
-                    SELECT 
-                        'test_completed' as activity_type,
-                        test_timestamp as activity_date,
-                        'MDQ测试' as activity_description,
-                        COALESCE(mdq_score, raw_score) as score,
-                        severity_level
-                    FROM questionnaire_tests 
-                    WHERE user_id = ? AND questionnaire_type = 'MDQ'
-                    ORDER BY test_timestamp DESC
-                    LIMIT ?
-                ''', (user_id, limit))
+            cursor.execute(self._SQL_ACTIVITY_LOG, (user_id, limit))
                 
-            activities = []
-            for row in cursor.fetchall():
-                activity = {
-                        'type': row[0],
-                        'date': row[1],
-                        'description': row[2],
-                        'details': {
-                            'mdq_score': row[3],
-                            'severity': row[4]
-                        }
+            for row in cursor:
+                yield {
+                    'type': row['activity_type'],
+                    'date': row['activity_date'],
+                    'description': row['activity_description'],
+                    'details': {
+                        'mdq_score': row['score'],
+                        'severity': row['severity_level']
                     }
-                activities.append(activity)
-                
-            return activities
-            
-        except sqlite3.Error as e:
-            print(f"获取用户活动日志失败: {e}")
-            return []
+                }
         finally:
             if conn:
                 conn.close()
+    
+    def get_user_activity_log(self, user_id: str, limit: int = 20) -> List[Dict]:
+        """获取用户活动日志"""
+        try:
+            return list(self.iter_user_activity_log(user_id, limit))
+        except sqlite3.Error as e:
+            print(f"获取用户活动日志失败: {e}")
+            return []
 
     # ==================== 数据迁移和兼容性 ====================
     
-    def migrate_old_scores_to_mdq_standard(self) -> Dict:
-        """将旧的评分数据迁移到标准MDQ格式"""
+    def migrate_old_scores_to_mdq_standard(self, batch_size: int = 5000) -> Dict:
+        """将旧的评分数据迁移到标准MDQ格式
+        
+        直接在SQLite内通过 json_each 计算标准MDQ分数，单条 UPDATE 完成迁移；
+        SQLite 低于 3.38（JSON函数非默认内置）时退回 Python 批量迁移。
+        """
+        if sqlite3.sqlite_version_info < (3, 38, 0):
+            return self._migrate_old_scores_batched(batch_size)
+        
         conn = None
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            # 查找需要迁移的记录（有raw_score但没有mdq_score的记录）
-            cursor.execute('''
-                SELECT test_id, user_id, test_data, raw_score
-                FROM questionnaire_tests 
-                WHERE questionnaire_type = 'MDQ' 
+            # 需要迁移的记录：有raw_score但没有mdq_score
+            pending_filter = '''
+                questionnaire_type = 'MDQ' 
                 AND raw_score IS NOT NULL 
                 AND mdq_score IS NULL
+            '''
+            # 可迁移的记录：test_data 为JSON对象，questions 缺失或为对象
+            valid_filter = '''
+                AND CASE WHEN json_valid(test_data) THEN json_type(test_data) END = 'object'
+                AND COALESCE(json_type(test_data, '$.questions'), 'object') = 'object'
+            '''
+            
+            cursor.execute(f'SELECT COUNT(*) FROM questionnaire_tests WHERE {pending_filter}')
+            total_records = cursor.fetchone()[0]
+            
+            # 标准MDQ：q1-q13 中只有'no'为0分，缺失按'no'处理
+            cursor.execute(f'''
+                UPDATE questionnaire_tests
+                SET mdq_score = (
+                    SELECT COUNT(*) FROM json_each(test_data, '$.questions')
+                    WHERE key IN ('q1', 'q2', 'q3', 'q4', 'q5', 'q6', 'q7',
+                                  'q8', 'q9', 'q10', 'q11', 'q12', 'q13')
+                    AND value IS NOT 'no'
+                )
+                WHERE {pending_filter} {valid_filter}
             ''')
+            migrated_count = cursor.rowcount
+            error_count = total_records - migrated_count
+            
+            conn.commit()
+            
+            if error_count:
+                print(f"迁移记录失败: {error_count} 条记录的测试数据无法解析")
+            
+            return {
+                'total_records': total_records,
+                'migrated_count': migrated_count,
+                'error_count': error_count,
+                'success_rate': round((migrated_count / total_records) * 100, 1) if total_records else 100
+            }
+            
+        except sqlite3.Error as e:
+            print(f"数据迁移失败: {e}")
+            if conn:
+                conn.rollback()
+            return {'error': str(e)}
+        finally:
+            if conn:
+                conn.close()
+    
+    def _migrate_old_scores_batched(self, batch_size: int = 5000) -> Dict:
+        """在Python中解析测试数据的迁移路径
+        
+        按 rowid 分页流式读取待迁移记录，每页以 executemany 批量更新，
+        整个迁移在同一事务内完成，只提交一次。
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            conn.execute('BEGIN')
+            select_cursor = conn.cursor()
+            update_cursor = conn.cursor()
             
-            records_to_migrate = cursor.fetchall()
+            total_records = 0
             migrated_count = 0
             error_count = 0
+            last_rowid = 0
             
-            for test_id, user_id, test_data_str, raw_score in records_to_migrate:
-                try:
-                    # 解析测试数据
-                    test_data = json.loads(test_data_str)
-                    questions = test_data.get('questions', {})
-                    
-                    # 计算标准MDQ分数
-                    mdq_score = 0
-                    for q_id in [f'q{i}' for i in range(1, 14)]:
-                        answer = questions.get(q_id, 'no')
-                        if answer != 'no':  # 标准MDQ：只有'no'为0分
-                            mdq_score += 1
-                    
-                    # 更新记录
-                    cursor.execute('''
+            while True:
+                # 查找需要迁移的记录（有raw_score但没有mdq_score的记录）
+                select_cursor.execute('''
+                    SELECT rowid, test_id, test_data
+                    FROM questionnaire_tests 
+                    WHERE questionnaire_type = 'MDQ' 
+                    AND raw_score IS NOT NULL 
+                    AND mdq_score IS NULL
+                    AND rowid > ?
+                    ORDER BY rowid
+                    LIMIT ?
+                ''', (last_rowid, batch_size))
+                
+                records = select_cursor.fetchall()
+                if not records:
+                    break
+                
+                batch = []
+                for rowid, test_id, test_data_str in records:
+                    last_rowid = rowid
+                    try:
+                        # 解析测试数据
+                        test_data = json_loads(test_data_str)
+                        questions = test_data.get('questions', {})
+                        
+                        # 计算标准MDQ分数（标准MDQ：只有'no'为0分）
+                        mdq_score = sum(1 for q_id in _Q_IDS if questions.get(q_id, 'no') != 'no')
+                        batch.append((mdq_score, test_id))
+                        
+                    except Exception as e:
+                        print(f"迁移记录失败 {test_id}: {e}")
+                        error_count += 1
+                
+                # 批量更新记录
+                if batch:
+                    update_cursor.executemany('''
                         UPDATE questionnaire_tests 
                         SET mdq_score = ?
                         WHERE test_id = ?
-                    ''', (mdq_score, test_id))
-                    
-                    migrated_count += 1
-                    print(f"迁移记录: {test_id}, 原始分数: {raw_score}, 标准MDQ分数: {mdq_score}")
-                    
-                except Exception as e:
-                    print(f"迁移记录失败 {test_id}: {e}")
-                    error_count += 1
+                    ''', batch)
+                    migrated_count += len(batch)
+                
+                total_records += len(records)
+                print(f"迁移进度: 已处理 {total_records} 条记录，成功 {migrated_count} 条")
             
             conn.commit()
             
             return {
-                'total_records': len(records_to_migrate),
+                'total_records': total_records,
                 'migrated_count': migrated_count,
                 'error_count': error_count,
-                'success_rate': round((migrated_count / len(records_to_migrate)) * 100, 1) if records_to_migrate else 100
+                'success_rate': round((migrated_count / total_records) * 100, 1) if total_records else 100
             }
             
         except sqlite3.Error as e:
             print(f"数据迁移失败: {e}")
+            if conn:
+                conn.rollback()
             return {'error': str(e)}
         finally:
             if conn:
@@ -1465,7 +1716,8 @@ if __name__ == "__main__":
         {
             'name': '阴性测试（分数低于阈值）',
             'test_data': {
-                'questions': {f'q{i}': 'no' if i > 5 else 'yes' for i in range(1, 14)},  # 5个yes
+                'questions': {'q1': 'yes', 'q2': 'yes', 'q3': 'yes', 'q4': 'yes', 'q5': 'yes', 'q6': 'no', 'q7': 'no',
+                              'q8': 'no', 'q9': 'no', 'q10': 'no', 'q11': 'no', 'q12': 'no', 'q13': 'no'},  # 5个yes
                 'co_occurrence': 'yes',
                 'severity': 'moderate'
             },
@@ -1475,7 +1727,8 @@ if __name__ == "__main__":
         {
             'name': '轻度阳性测试',
             'test_data': {
-                'questions': {f'q{i}': 'yes' if i <= 8 else 'no' for i in range(1, 14)},  # 8个yes
+                'questions': {'q1': 'yes', 'q2': 'yes', 'q3': 'yes', 'q4': 'yes', 'q5': 'yes', 'q6': 'yes', 'q7': 'yes',
+                              'q8': 'yes', 'q9': 'no', 'q10': 'no', 'q11': 'no', 'q12': 'no', 'q13': 'no'},  # 8个yes
                 'co_occurrence': 'yes',
                 'severity': 'minor'
             },
@@ -1485,7 +1738,8 @@ if __name__ == "__main__":
         {
             'name': '高度阳性测试',
             'test_data': {
-                'questions': {f'q{i}': 'yes' if i <= 11 else 'no' for i in range(1, 14)},  # 11个yes
+                'questions': {'q1': 'yes', 'q2': 'yes', 'q3': 'yes', 'q4': 'yes', 'q5': 'yes', 'q6': 'yes', 'q7': 'yes',
+                              'q8': 'yes', 'q9': 'yes', 'q10': 'yes', 'q11': 'yes', 'q12': 'no', 'q13': 'no'},  # 11个yes
                 'co_occurrence': 'yes',
                 'severity': 'serious'
             },
@@ -1495,7 +1749,8 @@ if __name__ == "__main__":
         {
             'name': '亚临床阳性测试（无功能损害）',
             'test_data': {
-                'questions': {f'q{i}': 'yes' if i <= 9 else 'no' for i in range(1, 14)},  # 9个yes
+                'questions': {'q1': 'yes', 'q2': 'yes', 'q3': 'yes', 'q4': 'yes', 'q5': 'yes', 'q6': 'yes', 'q7': 'yes',
+                              'q8': 'yes', 'q9': 'yes', 'q10': 'no', 'q11': 'no', 'q12': 'no', 'q13': 'no'},  # 9个yes
                 'co_occurrence': 'yes',
                 'severity': 'no'
             },
@@ -1515,7 +1770,7 @@ if __name__ == "__main__":
         print(f"MDQ结果: {result['mdq_result']}")
         print(f"期望结果: {test_case['expected_result']}")
         print(f"风险百分比: {result['risk_percentage']}%")
-        print(f"严重程度: {result['severity_level'].value}")
+        print(f"严重程度: {result['severity_level']}")
         
         # 验证结果
         score_correct = result['mdq_score'] == test_case['expected_mdq_score']
@@ -3,20 +3,413 @@
 import os
 
 DEEPSEEK_API_KEY = os.environ.get('DEEPSEEK_API_KEY', "sk-cb387c428d9343328cea734e6ae0f9f5")
+DEEPSEEK_MODEL = "deepseek-chat"
+# 每分钟请求数上限（批量生成时的限流预算）
+DEEPSEEK_QPM = int(os.environ.get('DEEPSEEK_QPM', 500))
+# 同时在途的API请求数上限
+DEEPSEEK_CONCURRENCY = int(os.environ.get('DEEPSEEK_CONCURRENCY', 20))
+# 批量生成报告时的工作线程数
+ADVISOR_WORKERS = int(os.environ.get('ADVISOR_WORKERS', 16))
+# 上下文窗口与输出上限（tokens）
+DEEPSEEK_CONTEXT_TOKENS = 65536
+DEEPSEEK_MAX_OUTPUT_TOKENS = 4000
+# 采样温度：临床报告偏向稳定、可复现的输出
+DEEPSEEK_TEMPERATURE = 0.3
 
 # ====== 导入依赖 ======
 # Please install OpenAI SDK first: `pip3 install openai`
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIStatusError, RateLimitError
+import httpx  # OpenAI SDK 的HTTP依赖
+import asyncio
 import json
 import sqlite3
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from dataclasses import dataclass
 import uuid
 import time
-from database import DatabaseManager
+import traceback
+import hashlib
+import random
+import re
+import string
+import threading
+import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from database import DatabaseManager, json_dumps, json_loads
 from analyse import MDQAnalyzer
 
+# ====== HTTP连接池配置 ======
+# 保持长连接复用TLS会话；读超时沿用原先的120秒，连接/连接池等待快速失败
+_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60)
+_HTTP_TIMEOUT = httpx.Timeout(120.0, connect=5.0, write=10.0, pool=5.0)
+
+try:
+    import h2  # noqa: F401  HTTP/2 需要 httpx[http2]
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+def _create_http_client(async_client: bool = False):
+    """创建连接池调优后的 httpx 客户端，供 OpenAI SDK 使用"""
+    client_cls = httpx.AsyncClient if async_client else httpx.Client
+    return client_cls(http2=_HTTP2_AVAILABLE, limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT)
+
+def _is_retryable_error(error: Exception) -> bool:
+    """限流(429)与服务端错误(5xx)重试；其余4xx为请求本身的问题，不重试"""
+    if isinstance(error, RateLimitError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    return True  # 连接错误、超时等
+
+class _TruncatedResponseError(Exception):
+    """输出达到 max_tokens 被截断（finish_reason == 'length'）"""
+
+def _backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """指数退避加随机抖动；服务端给出 Retry-After 时取较大值"""
+    delay = min(30.0, 0.5 * 2 ** attempt) + random.random() * 0.25
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get('retry-after', 0)))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+# 单次测试AI输入的字段表：(输出字段, 分区名, 分区内键, 旧格式平铺键, 默认值)
+# 分区内存在该键时取分区值，否则回退到旧数据格式的平铺键
+_SINGLE_TEST_INPUT_FIELDS = (
+    ('age', 'patient_demographics', 'age', 'age', 'Unknown'),
+    ('gender', 'patient_demographics', 'gender', 'gender', 'Unknown'),
+    ('total_assessments', 'patient_demographics', 'total_assessments', 'total_assessments', 1),
+    ('assessment_span_days', 'patient_demographics', 'assessment_span_days', 'assessment_span_days', 0),
+    ('mdq_score', 'mdq_standard_results', 'part1_score', 'mdq_part1_score', 0),
+    ('risk_percentage', 'mdq_standard_results', 'risk_percentage', 'risk_percentage', 0),
+    ('severity_level', 'mdq_standard_results', 'severity_level', 'severity_level', 'negative'),
+    ('functional_impact', 'mdq_standard_results', 'functional_impact_level', 'functional_impact_level', 'no_problems'),
+    ('positive_symptoms', 'symptom_patterns', 'positive_symptoms_list', 'positive_symptoms', ()),
+)
+
+# 提示词中显示的标签（snake_case -> Title Case），未收录的值按原规则现算
+_DISPLAY_TITLES = {
+    # 症状分类
+    'mood_elevation': 'Mood Elevation',
+    'grandiosity': 'Grandiosity',
+    'sleep_changes': 'Sleep Changes',
+    'speech_changes': 'Speech Changes',
+    'cognitive_symptoms': 'Cognitive Symptoms',
+    'behavioral_activation': 'Behavioral Activation',
+    'risk_behaviors': 'Risk Behaviors',
+    'functional_impact': 'Functional Impact',
+    # 严重程度
+    'negative': 'Negative',
+    'mild_positive': 'Mild Positive',
+    'moderate_positive': 'Moderate Positive',
+    'high_positive': 'High Positive',
+    # 功能影响
+    'no_problems': 'No Problems',
+    'minor_problems': 'Minor Problems',
+    'moderate_problems': 'Moderate Problems',
+    'serious_problems': 'Serious Problems',
+}
+
+def _display_title(value) -> str:
+    """返回 value.replace('_', ' ').title() 的结果，常见取值直接查表"""
+    title = _DISPLAY_TITLES.get(value) if isinstance(value, str) else None
+    if title is None:
+        title = str(value).replace('_', ' ').title()
+    return title
+
+def _extract_fields(ai_data: Dict, fields) -> Dict:
+    """按字段表一次性提取输入数据（分区优先，平铺键兜底）"""
+    sections = {}
+    values = {}
+    for output_key, section_name, key, flat_key, default in fields:
+        section = sections.get(section_name)
+        if section is None:
+            section = sections[section_name] = ai_data.get(section_name, {})
+        if key in section:
+            values[output_key] = section[key]
+        else:
+            values[output_key] = ai_data.get(flat_key, default)
+    return values
+
+def _as_list(value) -> List:
+    """将已解析的列表或JSON文本统一为列表；无法解析时返回空列表"""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, (str, bytes)):
+        try:
+            parsed = json_loads(value)
+        except ValueError:
+            return []
+        return parsed if isinstance(parsed, list) else []
+    return []
+
+def _uuid7() -> str:
+    """生成时间有序的 UUIDv7 字符串（48位毫秒时间戳 + 随机位），主键插入集中在B树尾部"""
+    if hasattr(uuid, 'uuid7'):  # Python 3.14+
+        return str(uuid.uuid7())
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = (value & ~(0xF << 76)) | (0x7 << 76)   # version 7
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)   # RFC 4122 variant
+    return str(uuid.UUID(int=value))
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+def _estimate_tokens(text: str) -> int:
+    """估算文本token数：按DeepSeek官方换算，中文约0.6 token/字，英文约0.3 token/字符"""
+    cjk_count = len(_CJK_RE.findall(text))
+    return int(cjk_count * 0.6 + (len(text) - cjk_count) * 0.3) + 1
+
+class _RateLimiter:
+    """令牌桶限流器：time_period 秒内最多 max_rate 次请求，同时最多 max_concurrency 个请求在途
+    
+    同步调用使用 with，异步调用使用 async with。令牌预留与在途名额都基于线程锁/信号量，
+    不跨 await 持有锁，因此线程池工作线程与多个事件循环可共享同一实例。
+    """
+    
+    def __init__(self, max_rate: int, time_period: float = 60.0, max_concurrency: int = 20):
+        self.max_rate = max(1, max_rate)
+        self._rate = self.max_rate / time_period
+        self._tokens = float(self.max_rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+    
+    def _reserve(self) -> float:
+        """预留一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_rate, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+    
+    def __enter__(self):
+        self._slots.acquire()
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self._slots.release()
+        return False
+    
+    async def __aenter__(self):
+        # 轮询获取在途名额，避免阻塞事件循环
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(0.01)
+        try:
+            delay = self._reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except BaseException:
+            self._slots.release()
+            raise
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self._slots.release()
+        return False
+
+class _LRUCache:
+    """线程安全的小型LRU缓存（进程内）"""
+    
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+def _compile_header_re(section_patterns: Dict[str, str]):
+    """编译章节标题正则
+    
+    只捕获标题本身，使 re.split 结果为 [标题前文本, 标题1, 正文1, 标题2, 正文2, ...]；
+    行首包裹标题的 Markdown 标记（如 "### [X]"、"**[X]**"）一并匹配后丢弃，
+    不会残留在上一章节或本章节的正文中。
+    """
+    headers = '|'.join(re.escape(pattern) for pattern in section_patterns)
+    return re.compile(r'(?:^[ \t]*[#*_>]+[ \t]*)?(' + headers + r')(?:\*\*|__)?', re.MULTILINE)
+
+# 单次测试报告章节标题 -> 字段名（同时支持英文与中文格式）
+_SINGLE_TEST_SECTION_PATTERNS = {
+    '[EXECUTIVE SUMMARY]': 'executive_summary',
+    '[CLINICAL ASSESSMENT]': 'clinical_assessment',
+    '[RISK EVALUATION]': 'risk_evaluation',
+    '[TREATMENT RECOMMENDATIONS]': 'treatment_recommendations',
+    '[LIFESTYLE RECOMMENDATIONS]': 'lifestyle_recommendations',
+    '[MONITORING PLAN]': 'monitoring_plan',
+    '[EMERGENCY PROTOCOLS]': 'emergency_protocols',
+    # Fallback to Chinese patterns for compatibility
+    '【执行摘要】': 'executive_summary',
+    '【临床评估】': 'clinical_assessment',
+    '【风险评估】': 'risk_evaluation',
+    '【治疗建议】': 'treatment_recommendations',
+    '【生活方式建议】': 'lifestyle_recommendations',
+    '【监测计划】': 'monitoring_plan',
+    '【紧急预案】': 'emergency_protocols'
+}
+_SINGLE_TEST_HEADER_RE = _compile_header_re(_SINGLE_TEST_SECTION_PATTERNS)
+
+# 列表条目前缀：- 或 •（后面可不接空白），单个 * 或数字编号（如 "1."、"12."）须后接空白，
+# 以免把 Markdown 加粗 "**" 和小数当作条目；group(1) 为条目内容
+_BULLET_RE = re.compile(r'(?:[-•]\s*|(?:\*(?!\*)|\d+\.)\s+)(.*)', re.DOTALL)
+
+# 单次测试报告中按条目列表解析的章节
+_SINGLE_TEST_LIST_SECTIONS = frozenset(('treatment_recommendations', 'lifestyle_recommendations'))
+
+# 单次测试报告各章节（按输出顺序）及AI未给出内容时的默认文本
+_SINGLE_TEST_FALLBACKS = (
+    ('executive_summary', 'Patient requires further evaluation by a professional physician'),
+    ('clinical_assessment', 'Comprehensive clinical assessment is recommended'),
+    ('risk_evaluation', 'Risk assessment requires professional medical judgment'),
+    ('treatment_recommendations', 'Consult with a psychiatrist to develop a personalized treatment plan'),
+    ('lifestyle_recommendations', 'Maintain regular sleep schedule and healthy lifestyle habits'),
+    ('monitoring_plan', 'Regular follow-up and symptom monitoring recommended'),
+    ('emergency_protocols', 'In case of emergency, contact a physician immediately or call emergency services'),
+)
+
+# 历史分析报告章节标题 -> 字段名（同时支持英文与中文格式）
+_HISTORICAL_SECTION_PATTERNS = {
+    '[EXECUTIVE SUMMARY]': 'executive_summary',
+    '[PROGRESS ANALYSIS]': 'progress_analysis',
+    '[TREND INTERPRETATION]': 'trend_interpretation',
+    '[TREATMENT RECOMMENDATIONS]': 'treatment_recommendations',
+    '[PROGNOSIS ASSESSMENT]': 'prognosis_assessment',
+    # Fallback to Chinese patterns for compatibility
+    '【执行摘要】': 'executive_summary',
+    '【进展分析】': 'progress_analysis',
+    '【趋势解读】': 'trend_interpretation',
+    '【治疗建议】': 'treatment_recommendations',
+    '【预后评估】': 'prognosis_assessment'
+}
+_HISTORICAL_HEADER_RE = _compile_header_re(_HISTORICAL_SECTION_PATTERNS)
+
+# 历史分析报告各章节（按输出顺序）及默认文本
+_HISTORICAL_FALLBACKS = (
+    ('executive_summary', 'Based on historical data analysis, overall treatment progress requires continuous monitoring and professional evaluation'),
+    ('progress_analysis', 'Based on available data, treatment progress requires continuous monitoring and professional evaluation'),
+    ('trend_interpretation', 'Symptom trend changes require comprehensive assessment in conjunction with clinical presentation'),
+    ('treatment_recommendations', 'Continue current treatment plan with regular effectiveness assessments'),
+    ('prognosis_assessment', 'Prognosis assessment requires consideration of multiple factors. Regular professional evaluation is recommended'),
+)
+
+# 备用报告模板：按 MDQ 分数是否 >= 7 选择分支文本，建议列表预先拼接
+_FALLBACK_REPORT_TEMPLATE = """
+    [EXECUTIVE SUMMARY]: Based on MDQ assessment results ({mdq_score}/13 points), the patient's current status is {severity}. Continued monitoring and professional evaluation are recommended.
+
+    [CLINICAL ASSESSMENT]: The MDQ questionnaire shows a patient score of {mdq_score} points, with a risk assessment of {risk_percentage}%. According to standard MDQ scoring criteria, {assessment}.
+
+    [RISK EVALUATION]: {risk}.
+
+    [TREATMENT RECOMMENDATIONS]:
+    {recommendations}
+
+    [LIFESTYLE RECOMMENDATIONS]:
+    {lifestyle}
+
+    [MONITORING PLAN]: {frequency} mental health assessments are recommended. Seek medical attention promptly if symptoms change.
+
+    [EMERGENCY PROTOCOLS]: If severe mood swings, self-harm or suicidal thoughts, or severe functional impairment occur, please contact a medical professional immediately or call emergency services.
+
+    *Note: This report uses fallback generation mode due to network issues. Detailed evaluation by a professional physician is recommended.*
+    """
+
+_FALLBACK_REPORT_BRANCHES = {
+    True: {
+        'severity': 'requires attention',
+        'assessment': 'further professional evaluation is recommended',
+        'risk': 'Moderate risk - professional medical evaluation needed',
+        'recommendations': '\n'.join(f'- {rec}' for rec in (
+            "Consult with a mental health professional as soon as possible",
+            "Monitor mood and behavioral changes closely",
+            "Maintain regular sleep schedule"
+        )),
+        'lifestyle': '\n'.join(f'- {rec}' for rec in (
+            "Avoid excessive stress and overstimulation",
+            "Engage in moderate exercise",
+            "Seek support from family and friends"
+        )),
+        'frequency': 'Monthly',
+    },
+    False: {
+        'severity': 'relatively stable',
+        'assessment': 'no obvious abnormalities, but continued monitoring is needed',
+        'risk': 'Low risk - regular follow-up recommended',
+        'recommendations': '\n'.join(f'- {rec}' for rec in (
+            "Continue monitoring mental health status",
+            "Seek medical attention if symptoms change"
+        )),
+        'lifestyle': '\n'.join(f'- {rec}' for rec in (
+            "Maintain healthy lifestyle habits",
+            "Schedule regular mental health assessments"
+        )),
+        'frequency': 'Quarterly',
+    },
+}
+
+# 明确低风险（MDQ < 3 分、风险 < 5%、无阳性症状）时不调用API，直接使用模板报告
+_LOW_RISK_MAX_SCORE = 3
+_LOW_RISK_MAX_PERCENTAGE = 5
+_NO_POSITIVE_SYMPTOMS = "No significant positive symptoms"
+_LOW_RISK_MODEL_VERSION = 'template-v1'
+_LOW_RISK_REPORT_TEMPLATE = """[EXECUTIVE SUMMARY]: The MDQ screening result ({mdq_score}/13 points, estimated risk {risk_percentage}%) is negative and no positive symptoms were reported. The patient's current status is stable.
+
+[CLINICAL ASSESSMENT]: The MDQ score is well below the screening threshold of 7 points and no hypomanic or manic symptoms were endorsed. There is no indication of bipolar spectrum disorder at this time.
+
+[RISK EVALUATION]: Low risk - no current risk indicators identified.
+
+[TREATMENT RECOMMENDATIONS]:
+- No specific medical intervention is indicated at this time
+- Consult a mental health professional if mood or behavior changes
+
+[LIFESTYLE RECOMMENDATIONS]:
+- Maintain a regular sleep schedule
+- Keep up regular physical activity and healthy lifestyle habits
+- Stay connected with family and friends
+
+[MONITORING PLAN]: Routine self-monitoring of mood, with a repeat MDQ assessment every 6-12 months or sooner if symptoms appear.
+
+[EMERGENCY PROTOCOLS]: If severe mood swings, self-harm or suicidal thoughts, or severe functional impairment occur, please contact a medical professional immediately or call emergency services.
+"""
+
+def _compile_template(template: str) -> Tuple[Tuple[str, Optional[str], str, Optional[str]], ...]:
+    """预解析 str.format 模板为 (字面量, 字段名, 格式说明, 转换符) 序列"""
+    return tuple(string.Formatter().parse(template))
+
+def _render_template(compiled, data: Dict) -> str:
+    """按预解析结果渲染模板，结果与 template.format(**data) 一致"""
+    parts = []
+    for literal, field, format_spec, conversion in compiled:
+        parts.append(literal)
+        if field is not None:
+            value = data[field]
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 's':
+                value = str(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            parts.append(format(value, format_spec))
+    return ''.join(parts)
+
 @dataclass
 class AdvisorReport:
     """AI顾问报告数据类"""
@@ -48,29 +441,59 @@ class AdvisorReport:
 class DeepSeekAdvisor:
     """DeepSeek AI 分析顾问"""
     
+    # ==================== 常用查询语句 ====================
+    # 查询语句作为类常量复用，配合连接的语句缓存避免重复编译
+    
+    # 保存报告（列顺序与 _report_row 构造的行一致）
+    _SQL_INSERT_REPORT = '''
+        INSERT INTO ai_advisor_reports (
+            report_id, user_id, report_type, analysis_id, generated_at,
+            executive_summary, clinical_assessment, risk_evaluation,
+            treatment_recommendations, lifestyle_recommendations,
+            monitoring_plan, emergency_protocols,
+            progress_analysis, trend_interpretation, prognosis_assessment,
+            confidence_score, ai_model_version, processing_time,
+            ai_input_data, ai_response_raw
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    # 用户报告历史（全部类型 / 指定类型）
+    _SQL_USER_REPORTS = '''
+        SELECT report_id, report_type, generated_at, confidence_score, processing_time
+        FROM ai_advisor_reports
+        WHERE user_id = ?
+        ORDER BY generated_at DESC LIMIT ?
+    '''
+    
+    _SQL_USER_REPORTS_BY_TYPE = '''
+        SELECT report_id, report_type, generated_at, confidence_score, processing_time
+        FROM ai_advisor_reports
+        WHERE user_id = ? AND report_type = ?
+        ORDER BY generated_at DESC LIMIT ?
+    '''
+    
     def __init__(self, db_manager: DatabaseManager, analyzer: MDQAnalyzer):
         self.db_manager = db_manager
         self.analyzer = analyzer
-        self.client = None
-        self.api_available = False
-
-        # Validate API key and initialize client
-        try:
-            if not DEEPSEEK_API_KEY or DEEPSEEK_API_KEY == "your_deepseek_api_key_here":
-                print("WARNING: DeepSeek API key not set, using fallback report generation mode")
-                self.api_available = False
-            else:
-                # Initialize OpenAI client
-                self.client = OpenAI(
-                    api_key=DEEPSEEK_API_KEY,
-                    base_url="https://api.deepseek.com"
-                )
-                self.api_available = True
-                print("SUCCESS: DeepSeek API client initialized")
-        except Exception as e:
-            print(f"WARNING: DeepSeek API initialization failed: {e}")
-            print("WARNING: Using fallback report generation mode")
+        self._client = None
+        self._client_lock = threading.Lock()
+        
+        # AI响应缓存：进程内LRU在前，SQLite表 ai_advisor_cache 在后
+        self._response_cache = _LRUCache(maxsize=256)
+        # 报告写入后不再修改，按 report_id 缓存 get_report 的结果
+        self._report_cache = _LRUCache(maxsize=256)
+        # 分析记录写入后不再修改，按 analysis_id 缓存已准备好的AI输入
+        self._input_cache = _LRUCache(maxsize=512)
+        # API请求的QPM限流与在途并发上限，同步与异步调用共享
+        self._limiter = _RateLimiter(max_rate=DEEPSEEK_QPM, time_period=60,
+                                     max_concurrency=DEEPSEEK_CONCURRENCY)
+        
+        # Validate API key; the client itself is created on first use
+        if not DEEPSEEK_API_KEY or DEEPSEEK_API_KEY == "your_deepseek_api_key_here":
+            print("WARNING: DeepSeek API key not set, using fallback report generation mode")
             self.api_available = False
+        else:
+            self.api_available = True
 
         self._init_database_tables()
         
@@ -93,9 +516,15 @@ Please provide analysis in the following 7 sections with a professional, objecti
 
 Ensure all recommendations are evidence-based and follow clinical practice guidelines. All output must be in English.""",
 
-                'user_template': """Please generate an MDQ analysis report for the following patient:
+                # 7个章节的报告通常为600-900 tokens
+                'max_tokens': 1200,
+
+                # 静态说明在前、患者数据在后，保证提示词前缀稳定以命中DeepSeek上下文缓存
+                'user_prefix': """Please generate a complete clinical assessment report and treatment recommendations for the patient below, based on the MDQ analysis data that follows.
+
+""",
 
-**Patient Demographics:**
+                'user_template': """**Patient Demographics:**
 - Age: {age} years
 - Gender: {gender}
 - Total Assessments: {total_assessments}
@@ -121,9 +550,7 @@ Ensure all recommendations are evidence-based and follow clinical practice guide
 
 **Monitoring Priorities:** {monitoring_priorities}
 
-**Intervention Targets:** {intervention_targets}
-
-Please generate a complete clinical assessment report and treatment recommendations."""
+**Intervention Targets:** {intervention_targets}"""
             },
             
             'historical': {
@@ -141,9 +568,13 @@ Please provide analysis in the following 5 sections (strictly follow this format
 
 Provide recommendations based on evidence-based medicine and long-term management best practices. All output must be in English.""",
 
-                'user_template': """Please generate a historical trend analysis report for the following patient:
+                'max_tokens': 1800,
+
+                'user_prefix': """Please generate a historical trend analysis report for the patient below. Based on the historical data that follows, generate a comprehensive progress assessment report and long-term treatment recommendations in English.
+
+""",
 
-**Patient Demographics:**
+                'user_template': """**Patient Demographics:**
 - Age: {age} years
 - Gender: {gender}
 - Total Assessments: {total_assessments}
@@ -181,17 +612,52 @@ Provide recommendations based on evidence-based medicine and long-term managemen
 - Mean Score: {score_mean}
 - Standard Deviation: {score_std}
 - Score Range: {score_range}
-- Variability Coefficient: {variability_coefficient}
-
-Based on this historical data, please generate a comprehensive progress assessment report and long-term treatment recommendations in english."""
+- Variability Coefficient: {variability_coefficient}"""
             }
         }
+        
+        # 预解析用户提示词模板，渲染时不再重复扫描模板字符串
+        self._compiled_templates = {
+            prompt_type: _compile_template(prompt['user_template'])
+            for prompt_type, prompt in self.prompts.items()
+        }
+        # 系统提示词固定不变，token估算只做一次
+        self._system_token_counts = {
+            prompt['system']: _estimate_tokens(prompt['system'])
+            for prompt in self.prompts.values()
+        }
+        # 各类报告的输出上限，按系统提示词区分
+        self._output_token_limits = {
+            prompt['system']: prompt['max_tokens']
+            for prompt in self.prompts.values()
+        }
+    
+    @property
+    def client(self) -> Optional[OpenAI]:
+        """同步 OpenAI 客户端，首次调用API时才创建（延后连接池与TLS初始化）"""
+        if self._client is None and self.api_available:
+            with self._client_lock:
+                if self._client is None and self.api_available:
+                    try:
+                        self._client = OpenAI(
+                            api_key=DEEPSEEK_API_KEY,
+                            base_url="https://api.deepseek.com",
+                            http_client=_create_http_client()
+                        )
+                        print("SUCCESS: DeepSeek API client initialized")
+                    except Exception as e:
+                        print(f"WARNING: DeepSeek API initialization failed: {e}")
+                        print("WARNING: Using fallback report generation mode")
+                        self.api_available = False
+        return self._client
     
     def _init_database_tables(self):
-        """初始化AI顾问报告数据库表"""
+        """初始化AI顾问报告数据库表（建表与建索引在同一事务内完成）"""
+        conn = None
         try:
             conn = self.db_manager._get_connection()
             cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
             
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS ai_advisor_reports (
@@ -231,8 +697,30 @@ Based on this historical data, please generate a comprehensive progress assessme
                 )
             ''')
             
+            # AI响应缓存表（按模型+提示词的SHA-256索引）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ai_advisor_cache (
+                    prompt_hash TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
             # 创建索引
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_advisor_user_type ON ai_advisor_reports(user_id, report_type)')
+            # 与 get_user_reports 的过滤和排序一致，按索引倒序读取并在 LIMIT 处停止，无需排序；
+            # 末尾附带查询的其余列，成为覆盖索引，无需回表
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_advisor_user_time ON ai_advisor_reports(
+                    user_id, generated_at DESC, report_type, report_id, confidence_score, processing_time)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_advisor_user_type_time ON ai_advisor_reports(
+                    user_id, report_type, generated_at DESC, report_id, confidence_score, processing_time)
+            ''')
+            # 旧索引均为上面覆盖索引的前缀
+            cursor.execute('DROP INDEX IF EXISTS idx_advisor_user_generated')
+            cursor.execute('DROP INDEX IF EXISTS idx_advisor_user_type_generated')
+            cursor.execute('DROP INDEX IF EXISTS idx_advisor_user_type')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_advisor_generated_at ON ai_advisor_reports(generated_at)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_advisor_analysis_id ON ai_advisor_reports(analysis_id)')
             
@@ -241,43 +729,30 @@ Based on this historical data, please generate a comprehensive progress assessme
             
         except sqlite3.Error as e:
             print(f"AI顾问数据库表初始化失败: {e}")
+            if conn:
+                conn.rollback()
         finally:
             if conn:
                 conn.close()
     
-    def generate_single_test_report(self, analysis_id: str) -> AdvisorReport:
-        """生成单次测试分析报告 - 修复版"""
+    def generate_single_test_report(self, analysis_id: str, pending_saves: Optional[List] = None) -> AdvisorReport:
+        """生成单次测试分析报告 - 修复版
+        
+        传入 pending_saves 时报告不立即保存，而是追加到该列表由调用方批量写入。
+        """
         start_time = time.time()
         
         try:
-            # 获取分析数据
-            analysis_detail = self.analyzer.get_analysis_detail(analysis_id)
-            if not analysis_detail:
-                raise ValueError(f"分析记录 {analysis_id} 不存在")
-            
-            ai_data = self.analyzer.get_ai_analysis_data(analysis_id)
-            if not ai_data:
-                # 如果没有AI数据，尝试从analysis_detail构造
-                print(f"警告：没有找到AI分析数据，尝试从分析详情构造基础数据")
-                ai_data = {
-                    'mdq_part1_score': analysis_detail.get('mdq_part1_score', 0),
-                    'has_co_occurrence': analysis_detail.get('has_co_occurrence', False),
-                    'functional_impact_level': analysis_detail.get('functional_impact_level', 'no_problems'),
-                    'mdq_result': analysis_detail.get('mdq_result', 'negative'),
-                    'severity_level': analysis_detail.get('severity_level', 'negative'),
-                    'risk_percentage': analysis_detail.get('risk_percentage', 0),
-                    'positive_symptoms': json.loads(analysis_detail.get('positive_symptoms', '[]')) if analysis_detail.get('positive_symptoms') else [],
-                    'core_symptoms_count': analysis_detail.get('core_symptoms_count', 0)
-                }
-            
-            user_id = analysis_detail['user_id']
+            user_id, ai_input = self._load_single_test_input(analysis_id)
             
-            # 准备AI输入数据
-            ai_input = self._prepare_single_test_input(ai_data)
-            print(f"AI输入数据准备完成: MDQ分数={ai_input['mdq_score']}, 风险={ai_input['risk_percentage']}%")
+            # 明确低风险时直接使用模板报告
+            ai_response = self._low_risk_report(ai_input)
+            if ai_response is not None:
+                return self._build_single_test_report(analysis_id, user_id, ai_input, ai_response, start_time,
+                                                      pending_saves, _LOW_RISK_MODEL_VERSION)
             
             # 调用DeepSeek API
-            user_prompt = self.prompts['single_test']['user_template'].format(**ai_input)
+            user_prompt = self._render_user_prompt('single_test', ai_input)
             
             try:
                 ai_response = self._call_deepseek_api(
@@ -290,114 +765,205 @@ Based on this historical data, please generate a comprehensive progress assessme
                 # 生成备用报告
                 ai_response = self._generate_fallback_report(ai_input)
             
-            # 解析AI响应
-            parsed_response = self._parse_single_test_response(ai_response)
-            
-            # 计算处理时间
-            processing_time = time.time() - start_time
-            
-            # 创建报告对象
-            report = AdvisorReport(
-                report_id=str(uuid.uuid4()),
-                user_id=user_id,
-                report_type='single_test',
-                analysis_id=analysis_id,
-                generated_at=datetime.now(),
-                
-                executive_summary=parsed_response['executive_summary'],
-                clinical_assessment=parsed_response['clinical_assessment'],
-                risk_evaluation=parsed_response['risk_evaluation'],
-                treatment_recommendations=parsed_response['treatment_recommendations'],
-                lifestyle_recommendations=parsed_response['lifestyle_recommendations'],
-                monitoring_plan=parsed_response['monitoring_plan'],
-                emergency_protocols=parsed_response['emergency_protocols'],
-                
-                confidence_score=parsed_response.get('confidence_score', 0.8),
-                processing_time=processing_time
-            )
-            
-            # 保存到数据库
-            self._save_report(report, ai_input, ai_response)
-            
-            return report
+            return self._build_single_test_report(analysis_id, user_id, ai_input, ai_response, start_time,
+                                                  pending_saves)
             
         except Exception as e:
             print(f"生成单次测试报告失败: {e}")
-            import traceback
             traceback.print_exc()
             raise e
-    def _generate_fallback_report(self, ai_input: Dict) -> str:
-        """Generate fallback report (when API call fails)"""
-        mdq_score = ai_input.get('mdq_score', 0)
-        risk_percentage = ai_input.get('risk_percentage', 0)
-
-        if mdq_score >= 7:
-            severity = "requires attention"
-            recommendations = [
-                "Consult with a mental health professional as soon as possible",
-                "Monitor mood and behavioral changes closely",
-                "Maintain regular sleep schedule"
-            ]
-            lifestyle = [
-                "Avoid excessive stress and overstimulation",
-                "Engage in moderate exercise",
-                "Seek support from family and friends"
-            ]
-        else:
-            severity = "relatively stable"
-            recommendations = [
-                "Continue monitoring mental health status",
-                "Seek medical attention if symptoms change"
-            ]
-            lifestyle = [
-                "Maintain healthy lifestyle habits",
-                "Schedule regular mental health assessments"
-            ]
-
-        return f"""
-    [EXECUTIVE SUMMARY]: Based on MDQ assessment results ({mdq_score}/13 points), the patient's current status is {severity}. Continued monitoring and professional evaluation are recommended.
-
-    [CLINICAL ASSESSMENT]: The MDQ questionnaire shows a patient score of {mdq_score} points, with a risk assessment of {risk_percentage}%. According to standard MDQ scoring criteria, {'further professional evaluation is recommended' if mdq_score >= 7 else 'no obvious abnormalities, but continued monitoring is needed'}.
-
-    [RISK EVALUATION]: {'Moderate risk - professional medical evaluation needed' if mdq_score >= 7 else 'Low risk - regular follow-up recommended'}.
-
-    [TREATMENT RECOMMENDATIONS]:
-    {chr(10).join(f'- {rec}' for rec in recommendations)}
-
-    [LIFESTYLE RECOMMENDATIONS]:
-    {chr(10).join(f'- {rec}' for rec in lifestyle)}
-
-    [MONITORING PLAN]: {'Monthly' if mdq_score >= 7 else 'Quarterly'} mental health assessments are recommended. Seek medical attention promptly if symptoms change.
-
-    [EMERGENCY PROTOCOLS]: If severe mood swings, self-harm or suicidal thoughts, or severe functional impairment occur, please contact a medical professional immediately or call emergency services.
-
-    *Note: This report uses fallback generation mode due to network issues. Detailed evaluation by a professional physician is recommended.*
-    """
-    def generate_historical_analysis_report(self, user_id: str) -> AdvisorReport:
-        """生成历史趋势分析报告"""
+    
+    async def agenerate_single_test_report(self, analysis_id: str, client=None,
+                                           pending_saves: Optional[List] = None) -> AdvisorReport:
+        """生成单次测试分析报告 - 异步版本
+        
+        client 为调用方在同一事件循环中创建的 AsyncOpenAI 客户端，批量生成时共享连接；
+        传入 pending_saves 时报告不立即保存，而是追加到该列表由调用方批量写入。
+        """
         start_time = time.time()
         
-        # 获取用户最新分析
-        analysis_history = self.analyzer.get_analysis_history(user_id, limit=1)
-        if not analysis_history:
-            raise ValueError(f"用户 {user_id} 没有分析记录")
+        user_id, ai_input = self._load_single_test_input(analysis_id)
+        
+        # 明确低风险时直接使用模板报告
+        ai_response = self._low_risk_report(ai_input)
+        if ai_response is not None:
+            return self._build_single_test_report(analysis_id, user_id, ai_input, ai_response, start_time,
+                                                  pending_saves, _LOW_RISK_MODEL_VERSION)
+        
+        # 调用DeepSeek API
+        user_prompt = self._render_user_prompt('single_test', ai_input)
+        
+        try:
+            ai_response = await self._acall_deepseek_api(
+                client,
+                self.prompts['single_test']['system'],
+                user_prompt
+            )
+            print(f"DeepSeek API调用成功，响应长度: {len(ai_response)}")
+        except Exception as api_error:
+            print(f"DeepSeek API调用失败: {api_error}")
+            # 生成备用报告
+            ai_response = self._generate_fallback_report(ai_input)
+        
+        return self._build_single_test_report(analysis_id, user_id, ai_input, ai_response, start_time,
+                                              pending_saves)
+    
+    def _render_user_prompt(self, prompt_type: str, ai_input: Dict) -> str:
+        """拼接用户提示词：静态前缀 + 患者数据"""
+        return self.prompts[prompt_type]['user_prefix'] + _render_template(self._compiled_templates[prompt_type], ai_input)
+    
+    def _load_single_test_input(self, analysis_id: str):
+        """读取分析数据并准备单次测试的AI输入，返回 (user_id, ai_input)"""
+        cached = self._input_cache.get(('single_test', analysis_id))
+        if cached is not None:
+            user_id, ai_input = cached
+            return user_id, dict(ai_input)
         
-        latest_analysis_id = analysis_history[0]['analysis_id']
-        ai_data = self.analyzer.get_ai_analysis_data(latest_analysis_id)
+        # 获取分析数据（详情与AI数据一次查询取回）
+        bundle = self.analyzer.get_analysis_bundle(analysis_id)
+        if not bundle:
+            raise ValueError(f"分析记录 {analysis_id} 不存在")
         
+        analysis_detail = bundle['detail']
+        ai_data = bundle['ai_data']
         if not ai_data:
-            raise ValueError(f"用户 {user_id} 的AI数据不完整")
+            # 如果没有AI数据，尝试从analysis_detail构造
+            print(f"警告：没有找到AI分析数据，尝试从分析详情构造基础数据")
+            ai_data = {
+                'mdq_part1_score': analysis_detail.get('mdq_part1_score', 0),
+                'has_co_occurrence': analysis_detail.get('has_co_occurrence', False),
+                'functional_impact_level': analysis_detail.get('functional_impact_level', 'no_problems'),
+                'mdq_result': analysis_detail.get('mdq_result', 'negative'),
+                'severity_level': analysis_detail.get('severity_level', 'negative'),
+                'risk_percentage': analysis_detail.get('risk_percentage', 0),
+                'positive_symptoms': _as_list(analysis_detail.get('positive_symptoms')),  # 详情中已解析为列表
+                'core_symptoms_count': analysis_detail.get('core_symptoms_count', 0)
+            }
+        
+        user_id = analysis_detail['user_id']
         
         # 准备AI输入数据
-        ai_input = self._prepare_historical_input(ai_data)
+        ai_input = self._prepare_single_test_input(ai_data)
+        print(f"AI输入数据准备完成: MDQ分数={ai_input['mdq_score']}, 风险={ai_input['risk_percentage']}%")
+        
+        self._input_cache.put(('single_test', analysis_id), (user_id, ai_input))
+        return user_id, dict(ai_input)
+    
+    def _build_single_test_report(self, analysis_id: str, user_id: str, ai_input: Dict,
+                                  ai_response: str, start_time: float,
+                                  pending_saves: Optional[List] = None,
+                                  model_version: str = DEEPSEEK_MODEL) -> AdvisorReport:
+        """解析AI响应，创建并保存单次测试报告（model_version 区分API生成与模板报告）"""
+        # 解析AI响应
+        parsed_response = self._parse_single_test_response(ai_response)
+        
+        # 计算处理时间
+        processing_time = time.time() - start_time
+        
+        # 创建报告对象
+        report = AdvisorReport(
+            report_id=_uuid7(),
+            user_id=user_id,
+            report_type='single_test',
+            analysis_id=analysis_id,
+            generated_at=datetime.now(),
+            
+            executive_summary=parsed_response['executive_summary'],
+            clinical_assessment=parsed_response['clinical_assessment'],
+            risk_evaluation=parsed_response['risk_evaluation'],
+            treatment_recommendations=parsed_response['treatment_recommendations'],
+            lifestyle_recommendations=parsed_response['lifestyle_recommendations'],
+            monitoring_plan=parsed_response['monitoring_plan'],
+            emergency_protocols=parsed_response['emergency_protocols'],
+            
+            confidence_score=parsed_response.get('confidence_score', 0.8),
+            ai_model_version=model_version,
+            processing_time=processing_time
+        )
+        
+        # 保存到数据库（批量生成时延后统一写入）
+        if pending_saves is not None:
+            pending_saves.append((report, ai_input, ai_response))
+        else:
+            self._save_report(report, ai_input, ai_response)
+        
+        return report
+    
+    def _low_risk_report(self, ai_input: Dict) -> Optional[str]:
+        """明确低风险的患者返回模板报告文本，否则返回 None"""
+        if (ai_input['positive_symptoms'] == _NO_POSITIVE_SYMPTOMS
+                and ai_input['mdq_score'] < _LOW_RISK_MAX_SCORE
+                and ai_input['risk_percentage'] < _LOW_RISK_MAX_PERCENTAGE):
+            return _LOW_RISK_REPORT_TEMPLATE.format(**ai_input)
+        return None
+    
+    def _generate_fallback_report(self, ai_input: Dict) -> str:
+        """Generate fallback report (when API call fails)"""
+        mdq_score = ai_input.get('mdq_score', 0)
+        branch = _FALLBACK_REPORT_BRANCHES[mdq_score >= 7]
+        return _FALLBACK_REPORT_TEMPLATE.format(
+            mdq_score=mdq_score,
+            risk_percentage=ai_input.get('risk_percentage', 0),
+            **branch
+        )
+    def generate_historical_analysis_report(self, user_id: str, pending_saves: Optional[List] = None) -> AdvisorReport:
+        """生成历史趋势分析报告（pending_saves 含义同 generate_single_test_report）"""
+        start_time = time.time()
+        
+        latest_analysis_id, ai_input = self._load_historical_input(user_id)
         
         # 调用DeepSeek API
-        user_prompt = self.prompts['historical']['user_template'].format(**ai_input)
+        user_prompt = self._render_user_prompt('historical', ai_input)
         ai_response = self._call_deepseek_api(
             self.prompts['historical']['system'],
             user_prompt
         )
         
+        return self._build_historical_report(user_id, latest_analysis_id, ai_input, ai_response, start_time,
+                                             pending_saves)
+    
+    async def agenerate_historical_analysis_report(self, user_id: str, client=None,
+                                                   pending_saves: Optional[List] = None) -> AdvisorReport:
+        """生成历史趋势分析报告 - 异步版本"""
+        start_time = time.time()
+        
+        latest_analysis_id, ai_input = self._load_historical_input(user_id)
+        
+        # 调用DeepSeek API
+        user_prompt = self._render_user_prompt('historical', ai_input)
+        ai_response = await self._acall_deepseek_api(
+            client,
+            self.prompts['historical']['system'],
+            user_prompt
+        )
+        
+        return self._build_historical_report(user_id, latest_analysis_id, ai_input, ai_response, start_time,
+                                             pending_saves)
+    
+    def _load_historical_input(self, user_id: str):
+        """读取用户最新分析并准备历史分析的AI输入，返回 (analysis_id, ai_input)"""
+        # 获取用户最新分析（一次查询取回AI数据）
+        bundle = self.analyzer.get_latest_analysis_bundle(user_id)
+        if not bundle:
+            raise ValueError(f"用户 {user_id} 没有分析记录")
+        
+        latest_analysis_id = bundle['detail']['analysis_id']
+        ai_data = bundle['ai_data']
+        
+        if not ai_data:
+            raise ValueError(f"用户 {user_id} 的AI数据不完整")
+        
+        # 准备AI输入数据（同一分析记录只准备一次）
+        ai_input = self._input_cache.get(('historical', latest_analysis_id))
+        if ai_input is None:
+            ai_input = self._prepare_historical_input(ai_data)
+            self._input_cache.put(('historical', latest_analysis_id), ai_input)
+        return latest_analysis_id, dict(ai_input)
+    
+    def _build_historical_report(self, user_id: str, latest_analysis_id: str, ai_input: Dict,
+                                 ai_response: str, start_time: float,
+                                 pending_saves: Optional[List] = None) -> AdvisorReport:
+        """解析AI响应，创建并保存历史分析报告"""
         # 解析AI响应
         parsed_response = self._parse_historical_response(ai_response)
         
@@ -406,7 +972,7 @@ Based on this historical data, please generate a comprehensive progress assessme
         
         # 创建报告对象
         report = AdvisorReport(
-            report_id=str(uuid.uuid4()),
+            report_id=_uuid7(),
             user_id=user_id,
             report_type='historical_analysis',
             analysis_id=latest_analysis_id,
@@ -428,54 +994,82 @@ Based on this historical data, please generate a comprehensive progress assessme
             processing_time=processing_time
         )
         
-        # 保存到数据库
-        self._save_report(report, ai_input, ai_response)
+        # 保存到数据库（批量生成时延后统一写入）
+        if pending_saves is not None:
+            pending_saves.append((report, ai_input, ai_response))
+        else:
+            self._save_report(report, ai_input, ai_response)
         
         return report
     
+    # ==================== 异步批量生成 ====================
+    
+    def _create_async_client(self):
+        """创建异步客户端（需在事件循环内创建并在同一循环中使用）"""
+        if not self.api_available:
+            return None
+        return AsyncOpenAI(
+            api_key=DEEPSEEK_API_KEY,
+            base_url="https://api.deepseek.com",
+            max_retries=0,  # 重试由 _acall_deepseek_api 控制
+            http_client=_create_http_client(async_client=True)
+        )
+    
+    async def agenerate_full_report(self, user_id: str, analysis_id: Optional[str] = None,
+                                    pending_saves: Optional[List] = None
+                                    ) -> Tuple[Union[AdvisorReport, Exception], Union[AdvisorReport, Exception]]:
+        """并发生成单次测试报告与历史分析报告，成功的报告在一个事务内保存
+        
+        analysis_id 为空时使用用户最新的分析记录。返回 (单次测试报告, 历史分析报告)，
+        生成失败的一项为其异常，另一项不受影响。
+        传入 pending_saves 时报告只加入该列表，由调用方统一写入。
+        """
+        if analysis_id is None:
+            analysis_history = self.analyzer.get_analysis_history(user_id, limit=1)
+            if not analysis_history:
+                raise ValueError(f"用户 {user_id} 没有分析记录")
+            analysis_id = analysis_history[0]['analysis_id']
+        
+        client = self._create_async_client()
+        saves = [] if pending_saves is None else pending_saves
+        
+        try:
+            single_report, historical_report = await asyncio.gather(
+                self.agenerate_single_test_report(analysis_id, client, saves),
+                self.agenerate_historical_analysis_report(user_id, client, saves),
+                return_exceptions=True
+            )
+        finally:
+            if client is not None:
+                await client.close()
+        
+        if pending_saves is None:
+            self.save_reports_bulk(saves)
+        return single_report, historical_report
+    
     def _prepare_single_test_input(self, ai_data: Dict) -> Dict:
         """准备单次测试的AI输入数据 - 修复版"""
         try:
-            # 从不同的数据结构中提取信息
-            demographics = ai_data.get('patient_demographics', {})
+            fields = _extract_fields(ai_data, _SINGLE_TEST_INPUT_FIELDS)
+            age = fields['age']
+            gender = fields['gender']
+            total_assessments = fields['total_assessments']
+            assessment_span = fields['assessment_span_days']
+            mdq_score = fields['mdq_score']
+            risk_percentage = fields['risk_percentage']
+            severity_level = fields['severity_level']
+            functional_impact = fields['functional_impact']
+            positive_symptoms = _as_list(fields['positive_symptoms'])
+            
             mdq_standard = ai_data.get('mdq_standard_results', {})
+            if mdq_standard:
+                has_co_occurrence = mdq_standard.get('has_co_occurrence', False)
+            else:
+                # 兼容旧数据格式
+                has_co_occurrence = 'mdq_part1_score' in ai_data and ai_data.get('has_co_occurrence', False)
             symptom_patterns = ai_data.get('symptom_patterns', {})
             clinical_context = ai_data.get('clinical_context', {})
             
-            # 兼容旧数据格式
-            if not mdq_standard and 'mdq_part1_score' in ai_data:
-                mdq_standard = {
-                    'part1_score': ai_data.get('mdq_part1_score', 0),
-                    'has_co_occurrence': ai_data.get('has_co_occurrence', False),
-                    'functional_impact_level': ai_data.get('functional_impact_level', 'no_problems'),
-                    'mdq_result': ai_data.get('mdq_result', 'negative'),
-                    'severity_level': ai_data.get('severity_level', 'negative'),
-                    'risk_percentage': ai_data.get('risk_percentage', 0)
-                }
-            
-            if not symptom_patterns and 'positive_symptoms' in ai_data:
-                symptom_patterns = {
-                    'positive_symptoms_list': ai_data.get('positive_symptoms', []),
-                    'core_symptoms_count': ai_data.get('core_symptoms_count', 0),
-                    'symptom_profile': ai_data.get('symptom_profile', {})
-                }
-            
-            # 安全获取基本信息
-            age = demographics.get('age', ai_data.get('age', 'Unknown'))
-            gender = demographics.get('gender', ai_data.get('gender', 'Unknown'))
-            total_assessments = demographics.get('total_assessments', ai_data.get('total_assessments', 1))
-            assessment_span = demographics.get('assessment_span_days', ai_data.get('assessment_span_days', 0))
-            
-            # 安全获取MDQ相关信息
-            mdq_score = mdq_standard.get('part1_score', ai_data.get('mdq_part1_score', 0))
-            risk_percentage = mdq_standard.get('risk_percentage', ai_data.get('risk_percentage', 0))
-            severity_level = mdq_standard.get('severity_level', ai_data.get('severity_level', 'negative'))
-            functional_impact = mdq_standard.get('functional_impact_level', ai_data.get('functional_impact_level', 'no_problems'))
-            
-            # 处理症状信息
-            positive_symptoms = symptom_patterns.get('positive_symptoms_list', ai_data.get('positive_symptoms', []))
-            core_symptoms_count = symptom_patterns.get('core_symptoms_count', ai_data.get('core_symptoms_count', 0))
-            
             # 格式化症状分布（简化版）
             symptom_categories = symptom_patterns.get('symptom_categories', {})
             if not symptom_categories and 'symptom_profile' in ai_data:
@@ -494,12 +1088,12 @@ Based on this historical data, please generate a comprehensive progress assessme
             symptom_text = ""
             for category, data in symptom_categories.items():
                 if isinstance(data, dict) and 'positive_count' in data:
-                    symptom_text += f"- {category.replace('_', ' ').title()}: {data['positive_count']}/{data['total_count']}\n"
+                    symptom_text += f"- {_display_title(category)}: {data['positive_count']}/{data['total_count']}\n"
 
             # Format positive symptoms
             symptoms_text = "\n".join([f"- {symptom}" for symptom in positive_symptoms[:5]])  # Limit to first 5
             if not symptoms_text:
-                symptoms_text = "No significant positive symptoms"
+                symptoms_text = _NO_POSITIVE_SYMPTOMS
             
             # 获取临床上下文
             emergency_indicators = clinical_context.get('emergency_indicators', [])
@@ -513,11 +1107,11 @@ Based on this historical data, please generate a comprehensive progress assessme
                 'assessment_span_days': int(assessment_span),
                 'mdq_score': int(mdq_score),
                 'weighted_score': float(mdq_score),  # Simplified: use MDQ score
-                'severity_level': str(severity_level).replace('_', ' ').title(),
+                'severity_level': _display_title(severity_level),
                 'risk_percentage': float(risk_percentage),
-                'functional_impairment': str(functional_impact).replace('_', ' ').title(),
+                'functional_impairment': _display_title(functional_impact),
                 'symptom_distribution': symptom_text if symptom_text else "No detailed symptom distribution data available",
-                'bipolar_risk_profile': f"MDQ Positive: {'Yes' if mdq_score >= 7 else 'No'}\nSymptom Co-occurrence: {'Yes' if mdq_standard.get('has_co_occurrence', False) else 'No'}",
+                'bipolar_risk_profile': f"MDQ Positive: {'Yes' if mdq_score >= 7 else 'No'}\nSymptom Co-occurrence: {'Yes' if has_co_occurrence else 'No'}",
                 'positive_symptoms': symptoms_text,
                 'emergency_indicators': ', '.join(emergency_indicators) if emergency_indicators else 'None',
                 'monitoring_priorities': ', '.join(monitoring_priorities) if monitoring_priorities else 'Routine monitoring',
@@ -598,15 +1192,90 @@ Based on this historical data, please generate a comprehensive progress assessme
             'variability_coefficient': round(stats.get('variability_coefficient', 0), 2)
         }
     
+    def _max_tokens_for(self, system_prompt: str, user_prompt: str,
+                        output_limit: Optional[int] = None) -> int:
+        """根据输入长度计算本次请求的 max_tokens，超出上下文时提前报错
+        
+        output_limit 为空时使用该提示词的输出上限。
+        """
+        system_tokens = self._system_token_counts.get(system_prompt)
+        if system_tokens is None:
+            system_tokens = _estimate_tokens(system_prompt)
+        input_tokens = system_tokens + _estimate_tokens(user_prompt)
+        
+        if output_limit is None:
+            output_limit = self._output_token_limits.get(system_prompt, DEEPSEEK_MAX_OUTPUT_TOKENS)
+        max_tokens = min(output_limit, DEEPSEEK_CONTEXT_TOKENS - input_tokens - 128)
+        if max_tokens <= 0:
+            raise Exception(f"DeepSeek API call rejected: prompt too long (~{input_tokens} tokens)")
+        return max_tokens
+    
+    # ==================== AI响应缓存 ====================
+    
+    @staticmethod
+    def _prompt_cache_key(system_prompt: str, user_prompt: str) -> str:
+        """缓存键：模型版本 + 系统提示词 + 用户提示词的SHA-256"""
+        payload = f"{DEEPSEEK_MODEL}\x00{system_prompt}\x00{user_prompt}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _get_cached_response(self, cache_key: str) -> Optional[str]:
+        """查询缓存的AI响应，未命中返回None"""
+        response = self._response_cache.get(cache_key)
+        if response is not None:
+            return response
+        
+        conn = None
+        try:
+            conn = self.db_manager._get_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT response FROM ai_advisor_cache WHERE prompt_hash = ?', (cache_key,))
+            result = cursor.fetchone()
+            if result:
+                self._response_cache.put(cache_key, result[0])
+                return result[0]
+            return None
+        except sqlite3.Error as e:
+            print(f"读取AI响应缓存失败: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+    
+    def _store_cached_response(self, cache_key: str, response: str):
+        """写入AI响应缓存"""
+        self._response_cache.put(cache_key, response)
+        
+        conn = None
+        try:
+            conn = self.db_manager._get_connection()
+            conn.execute('''
+                INSERT OR REPLACE INTO ai_advisor_cache (prompt_hash, response)
+                VALUES (?, ?)
+            ''', (cache_key, response))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"写入AI响应缓存失败: {e}")
+        finally:
+            if conn:
+                conn.close()
+    
     def _call_deepseek_api(self, system_prompt: str, user_prompt: str) -> str:
         """Call DeepSeek API - Enhanced error handling"""
+        # Identical prompts return the cached response without a network call
+        cache_key = self._prompt_cache_key(system_prompt, user_prompt)
+        cached_response = self._get_cached_response(cache_key)
+        if cached_response is not None:
+            print("[API Call] Cache hit - returning cached response")
+            return cached_response
+
         # If API unavailable, throw exception for fallback
         if not self.api_available or not self.client:
             raise Exception("DeepSeek API client not initialized or unavailable")
 
+        max_tokens = self._max_tokens_for(system_prompt, user_prompt)
+
         try:
             # Add timeout and retry mechanism
-            import time
             max_retries = 2  # Reduced retries for faster failure response
 
             for attempt in range(max_retries):
@@ -614,29 +1283,41 @@ Based on this historical data, please generate a comprehensive progress assessme
                     api_start_time = time.time()
                     print(f"[API Call] Attempt {attempt + 1}/{max_retries} - Starting DeepSeek API request...")
 
-                    response = self.client.chat.completions.create(
-                        model="deepseek-chat",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt}
-                        ],
-                        max_tokens=4000,
-                        temperature=0.7,
-                        stream=False,
-                        timeout=120  # Increased to 120 second timeout for longer responses
-                    )
+                    with self._limiter:
+                        response = self.client.chat.completions.create(
+                            model=DEEPSEEK_MODEL,
+                            messages=[
+                                {"role": "system", "content": system_prompt},
+                                {"role": "user", "content": user_prompt}
+                            ],
+                            max_tokens=max_tokens,
+                            temperature=DEEPSEEK_TEMPERATURE,
+                            stream=False  # 120s read timeout comes from the pooled http client
+                        )
+
+                    # 被截断的响应会丢失末尾章节，不使用也不缓存
+                    if response.choices[0].finish_reason == 'length':
+                        raise _TruncatedResponseError(f"Response truncated at max_tokens={max_tokens}")
 
                     api_duration = time.time() - api_start_time
                     response_content = response.choices[0].message.content
                     print(f"[API Call] Success - Duration: {api_duration:.2f}s, Response length: {len(response_content)} chars")
 
+                    self._store_cached_response(cache_key, response_content)
                     return response_content
 
                 except Exception as e:
                     api_duration = time.time() - api_start_time
                     print(f"[API Call] Failed after {api_duration:.2f}s (attempt {attempt + 1}/{max_retries}): {e}")
-                    if attempt < max_retries - 1:
-                        time.sleep(1)  # Fixed 1 second wait
+                    if isinstance(e, _TruncatedResponseError):
+                        # Retry once with the full output budget; if that is not larger, use the fallback
+                        raised_limit = self._max_tokens_for(system_prompt, user_prompt, DEEPSEEK_MAX_OUTPUT_TOKENS)
+                        if attempt < max_retries - 1 and raised_limit > max_tokens:
+                            max_tokens = raised_limit
+                            continue
+                        raise e
+                    if attempt < max_retries - 1 and _is_retryable_error(e):
+                        time.sleep(_backoff_delay(attempt, e))  # Jittered so pooled workers don't retry in lockstep
                     else:
                         raise e
 
@@ -644,218 +1325,258 @@ Based on this historical data, please generate a comprehensive progress assessme
             print(f"[API Call] Ultimately failed: {e}")
             raise Exception(f"DeepSeek API call failed: {str(e)}")
     
+    async def _acall_deepseek_api(self, client, system_prompt: str, user_prompt: str) -> str:
+        """Call DeepSeek API asynchronously with the given AsyncOpenAI client"""
+        cache_key = self._prompt_cache_key(system_prompt, user_prompt)
+        cached_response = self._get_cached_response(cache_key)
+        if cached_response is not None:
+            print("[API Call] Cache hit - returning cached response")
+            return cached_response
+
+        if not self.api_available or client is None:
+            raise Exception("DeepSeek API client not initialized or unavailable")
+
+        max_tokens = self._max_tokens_for(system_prompt, user_prompt)
+
+        max_retries = 5  # Backoff no longer blocks the event loop
+
+        for attempt in range(max_retries):
+            api_start_time = time.time()
+            try:
+                print(f"[API Call] Attempt {attempt + 1}/{max_retries} - Starting async DeepSeek API request...")
+
+                async with self._limiter:
+                    response = await client.chat.completions.create(
+                        model=DEEPSEEK_MODEL,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_prompt}
+                        ],
+                        max_tokens=max_tokens,
+                        temperature=DEEPSEEK_TEMPERATURE,
+                        stream=False
+                    )
+
+                # 被截断的响应会丢失末尾章节，不使用也不缓存
+                if response.choices[0].finish_reason == 'length':
+                    raise _TruncatedResponseError(f"Response truncated at max_tokens={max_tokens}")
+
+                api_duration = time.time() - api_start_time
+                response_content = response.choices[0].message.content
+                print(f"[API Call] Success - Duration: {api_duration:.2f}s, Response length: {len(response_content)} chars")
+
+                self._store_cached_response(cache_key, response_content)
+                return response_content
+
+            except Exception as e:
+                api_duration = time.time() - api_start_time
+                print(f"[API Call] Failed after {api_duration:.2f}s (attempt {attempt + 1}/{max_retries}): {e}")
+                if isinstance(e, _TruncatedResponseError):
+                    # Retry once with the full output budget; if that is not larger, use the fallback
+                    raised_limit = self._max_tokens_for(system_prompt, user_prompt, DEEPSEEK_MAX_OUTPUT_TOKENS)
+                    if attempt < max_retries - 1 and raised_limit > max_tokens:
+                        max_tokens = raised_limit
+                        continue
+                    print(f"[API Call] Ultimately failed: {e}")
+                    raise Exception(f"DeepSeek API call failed: {str(e)}")
+                if attempt < max_retries - 1 and _is_retryable_error(e):
+                    await asyncio.sleep(_backoff_delay(attempt, e))
+                else:
+                    print(f"[API Call] Ultimately failed: {e}")
+                    raise Exception(f"DeepSeek API call failed: {str(e)}")
+    
     def _parse_single_test_response(self, ai_response: str) -> Dict:
         """Parse single test AI response"""
         sections = {
-            'executive_summary': '',
-            'clinical_assessment': '',
-            'risk_evaluation': '',
-            'treatment_recommendations': [],
-            'lifestyle_recommendations': [],
-            'monitoring_plan': '',
-            'emergency_protocols': '',
-            'confidence_score': 0.8
+            section_name: [] if section_name in _SINGLE_TEST_LIST_SECTIONS else ''
+            for section_name, _ in _SINGLE_TEST_FALLBACKS
         }
+        sections['confidence_score'] = 0.8
 
         # Split response by sections - support both English and Chinese formats
-        section_patterns = {
-            '[EXECUTIVE SUMMARY]': 'executive_summary',
-            '[CLINICAL ASSESSMENT]': 'clinical_assessment',
-            '[RISK EVALUATION]': 'risk_evaluation',
-            '[TREATMENT RECOMMENDATIONS]': 'treatment_recommendations',
-            '[LIFESTYLE RECOMMENDATIONS]': 'lifestyle_recommendations',
-            '[MONITORING PLAN]': 'monitoring_plan',
-            '[EMERGENCY PROTOCOLS]': 'emergency_protocols',
-            # Fallback to Chinese patterns for compatibility
-            '【执行摘要】': 'executive_summary',
-            '【临床评估】': 'clinical_assessment',
-            '【风险评估】': 'risk_evaluation',
-            '【治疗建议】': 'treatment_recommendations',
-            '【生活方式建议】': 'lifestyle_recommendations',
-            '【监测计划】': 'monitoring_plan',
-            '【紧急预案】': 'emergency_protocols'
-        }
+        # 按章节标题一次切分，每段正文直接归属其章节，无需逐行匹配标题
+        section_patterns = _SINGLE_TEST_SECTION_PATTERNS
+        parts = _SINGLE_TEST_HEADER_RE.split(ai_response)
+        text_parts = {}
         
-        current_section = None
-        lines = ai_response.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+        for pattern, body in zip(parts[1::2], parts[2::2]):
+            section_name = section_patterns[pattern]
+            is_list_section = section_name in _SINGLE_TEST_LIST_SECTIONS
+            header_line, _, rest = body.partition('\n')
             
-            # 检查是否是新的章节
-            section_found = False
-            for pattern, section_name in section_patterns.items():
-                if pattern in line:
-                    current_section = section_name
-                    section_found = True
-                    # 提取章节标题后的内容
-                    content = line.replace(pattern, '').strip('：: ')
-                    if content:
-                        if section_name in ['treatment_recommendations', 'lifestyle_recommendations']:
-                            if content.startswith('-'):
-                                sections[section_name].append(content[1:].strip())
-                            else:
-                                sections[section_name].append(content)
-                        else:
-                            sections[section_name] = content
-                    break
+            # 标题所在行的剩余内容
+            content = header_line.strip().strip('：: ')
+            if content:
+                if is_list_section:
+                    if content.startswith('-'):
+                        sections[section_name].append(content[1:].strip())
+                    else:
+                        sections[section_name].append(content)
+                else:
+                    text_parts[section_name] = [content]
             
-            if not section_found and current_section:
-                # 继续当前章节的内容
-                if current_section in ['treatment_recommendations', 'lifestyle_recommendations']:
-                    if line.startswith('-'):
-                        sections[current_section].append(line[1:].strip())
-                    elif line.startswith(('•', '*', '1.', '2.', '3.', '4.', '5.')):
-                        clean_line = line.lstrip('•*123456789. ')
-                        sections[current_section].append(clean_line)
-                    elif sections[current_section] and not any(x in line for x in ['【', '】']):
+            # 继续当前章节的内容
+            for line in rest.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                
+                if is_list_section:
+                    bullet = _BULLET_RE.match(line)
+                    if bullet:
+                        sections[section_name].append(bullet.group(1))
+                    elif sections[section_name] and '【' not in line and '】' not in line:
                         # 如果不是新章节且有内容，追加到最后一个建议
-                        sections[current_section][-1] += ' ' + line
+                        sections[section_name][-1] += ' ' + line
                 else:
-                    if sections[current_section]:
-                        sections[current_section] += ' ' + line
-                    else:
-                        sections[current_section] = line
+                    text_parts.setdefault(section_name, []).append(line)
+        
+        # 文本章节的各行最后一次性拼接
+        for section_name, section_parts in text_parts.items():
+            sections[section_name] = ' '.join(section_parts)
         
         # Ensure required fields are not empty
-        if not sections['executive_summary']:
-            sections['executive_summary'] = 'Patient requires further evaluation by a professional physician'
-        if not sections['clinical_assessment']:
-            sections['clinical_assessment'] = 'Comprehensive clinical assessment is recommended'
-        if not sections['risk_evaluation']:
-            sections['risk_evaluation'] = 'Risk assessment requires professional medical judgment'
-        if not sections['treatment_recommendations']:
-            sections['treatment_recommendations'] = ['Consult with a psychiatrist to develop a personalized treatment plan']
-        if not sections['lifestyle_recommendations']:
-            sections['lifestyle_recommendations'] = ['Maintain regular sleep schedule and healthy lifestyle habits']
-        if not sections['monitoring_plan']:
-            sections['monitoring_plan'] = 'Regular follow-up and symptom monitoring recommended'
-        if not sections['emergency_protocols']:
-            sections['emergency_protocols'] = 'In case of emergency, contact a physician immediately or call emergency services'
+        for section_name, default in _SINGLE_TEST_FALLBACKS:
+            if not sections[section_name]:
+                sections[section_name] = [default] if section_name in _SINGLE_TEST_LIST_SECTIONS else default
 
         return sections
     
     def _parse_historical_response(self, ai_response: str) -> Dict:
         """Parse historical analysis AI response"""
-        # Define 5 section parsing patterns - support both English and Chinese
-        historical_patterns = {
-            '[EXECUTIVE SUMMARY]': 'executive_summary',
-            '[PROGRESS ANALYSIS]': 'progress_analysis',
-            '[TREND INTERPRETATION]': 'trend_interpretation',
-            '[TREATMENT RECOMMENDATIONS]': 'treatment_recommendations',
-            '[PROGNOSIS ASSESSMENT]': 'prognosis_assessment',
-            # Fallback to Chinese patterns for compatibility
-            '【执行摘要】': 'executive_summary',
-            '【进展分析】': 'progress_analysis',
-            '【趋势解读】': 'trend_interpretation',
-            '【治疗建议】': 'treatment_recommendations',
-            '【预后评估】': 'prognosis_assessment'
-        }
+        historical_patterns = _HISTORICAL_SECTION_PATTERNS
 
         # Initialize all fields
-        sections = {
-            'executive_summary': '',
-            'progress_analysis': '',
-            'trend_interpretation': '',
-            'treatment_recommendations': '',
-            'prognosis_assessment': ''
-        }
+        sections = {section_name: '' for section_name, _ in _HISTORICAL_FALLBACKS}
         
-        current_section = None
-        lines = ai_response.split('\n')
+        # 按章节标题一次切分，每段正文直接归属其章节
+        parts = _HISTORICAL_HEADER_RE.split(ai_response)
+        text_parts = {}
         
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+        for pattern, body in zip(parts[1::2], parts[2::2]):
+            section_name = historical_patterns[pattern]
+            header_line, _, rest = body.partition('\n')
             
-            # 检查历史分析章节
-            for pattern, section_name in historical_patterns.items():
-                if pattern in line:
-                    current_section = section_name
-                    content = line.replace(pattern, '').strip('：: ')
-                    if content:
-                        sections[section_name] = content
-                    break
-            else:
-                # 继续当前历史分析章节的内容
-                if current_section and current_section in historical_patterns.values():
-                    if sections[current_section]:
-                        sections[current_section] += ' ' + line
-                    else:
-                        sections[current_section] = line
+            content = header_line.strip().strip('：: ')
+            if content:
+                text_parts[section_name] = [content]
+            
+            # 继续当前历史分析章节的内容（各行最后一次性拼接）
+            section_parts = text_parts.setdefault(section_name, [])
+            for line in rest.splitlines():
+                line = line.strip()
+                if line:
+                    section_parts.append(line)
+        
+        for section_name, section_parts in text_parts.items():
+            sections[section_name] = ' '.join(section_parts)
         
         # Provide default values for empty historical analysis fields
-        if not sections['executive_summary']:
-            sections['executive_summary'] = 'Based on historical data analysis, overall treatment progress requires continuous monitoring and professional evaluation'
-        if not sections['progress_analysis']:
-            sections['progress_analysis'] = 'Based on available data, treatment progress requires continuous monitoring and professional evaluation'
-        if not sections['trend_interpretation']:
-            sections['trend_interpretation'] = 'Symptom trend changes require comprehensive assessment in conjunction with clinical presentation'
-        if not sections['treatment_recommendations']:
-            sections['treatment_recommendations'] = 'Continue current treatment plan with regular effectiveness assessments'
-        if not sections['prognosis_assessment']:
-            sections['prognosis_assessment'] = 'Prognosis assessment requires consideration of multiple factors. Regular professional evaluation is recommended'
+        for section_name, default in _HISTORICAL_FALLBACKS:
+            if not sections[section_name]:
+                sections[section_name] = default
 
         return sections
     
     def _save_report(self, report: AdvisorReport, ai_input: Dict, ai_response: str) -> bool:
         """保存报告到数据库"""
+        return self.save_reports_bulk([(report, ai_input, ai_response)]) == 1
+    
+    @staticmethod
+    def _report_row(report: AdvisorReport, ai_input: Dict, ai_response: str) -> tuple:
+        """构造一行报告数据（列顺序与 _SQL_INSERT_REPORT 一致）"""
+        return (
+            report.report_id,
+            report.user_id,
+            report.report_type,
+            report.analysis_id,
+            report.generated_at.isoformat(),
+            report.executive_summary,
+            report.clinical_assessment,
+            report.risk_evaluation,
+            json_dumps(report.treatment_recommendations),
+            json_dumps(report.lifestyle_recommendations),
+            report.monitoring_plan,
+            report.emergency_protocols,
+            report.progress_analysis,
+            report.trend_interpretation,
+            report.prognosis_assessment,
+            report.confidence_score,
+            report.ai_model_version,
+            report.processing_time,
+            json_dumps(ai_input),
+            ai_response
+        )
+    
+    def _insert_report_rows(self, rows: List) -> bool:
+        """在一个事务内写入报告行，失败时回滚"""
+        conn = None
         try:
             conn = self.db_manager._get_connection()
-            cursor = conn.cursor()
+            conn.execute('BEGIN IMMEDIATE')
             
-            cursor.execute('''
-                INSERT INTO ai_advisor_reports (
-                    report_id, user_id, report_type, analysis_id, generated_at,
-                    executive_summary, clinical_assessment, risk_evaluation,
-                    treatment_recommendations, lifestyle_recommendations,
-                    monitoring_plan, emergency_protocols,
-                    progress_analysis, trend_interpretation, prognosis_assessment,
-                    confidence_score, ai_model_version, processing_time,
-                    ai_input_data, ai_response_raw
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                report.report_id,
-                report.user_id,
-                report.report_type,
-                report.analysis_id,
-                report.generated_at.isoformat(),
-                report.executive_summary,
-                getattr(report, 'clinical_assessment', ''),
-                getattr(report, 'risk_evaluation', ''),
-                json.dumps(getattr(report, 'treatment_recommendations', ''), ensure_ascii=False),
-                json.dumps(getattr(report, 'lifestyle_recommendations', ''), ensure_ascii=False),
-                getattr(report, 'monitoring_plan', ''),
-                getattr(report, 'emergency_protocols', ''),
-                report.progress_analysis,
-                report.trend_interpretation,
-                report.prognosis_assessment,
-                report.confidence_score,
-                report.ai_model_version,
-                report.processing_time,
-                json.dumps(ai_input, ensure_ascii=False),
-                ai_response
-            ))
+            conn.executemany(self._SQL_INSERT_REPORT, rows)
             
             conn.commit()
-            print(f"AI顾问报告已保存: {report.report_id}")
             return True
             
         except sqlite3.Error as e:
             print(f"保存AI顾问报告失败: {e}")
+            if conn:
+                conn.rollback()
             return False
         finally:
             if conn:
                 conn.close()
     
+    def save_reports_bulk(self, items: List) -> int:
+        """在一个事务内批量保存报告
+        
+        items 为 (report, ai_input, ai_response) 元组列表，返回实际写入条数。
+        整批写入失败时改为逐条写入，只有出错的报告不会保存。
+        """
+        saved_reports = []
+        rows = []
+        for report, ai_input, ai_response in items:
+            try:
+                rows.append(self._report_row(report, ai_input, ai_response))
+                saved_reports.append(report)
+            except (TypeError, ValueError) as e:
+                print(f"保存AI顾问报告失败: {report.report_id}: {e}")
+        
+        if not rows:
+            return 0
+        
+        if self._insert_report_rows(rows):
+            for report in saved_reports:
+                print(f"AI顾问报告已保存: {report.report_id}")
+            return len(rows)
+        
+        if len(rows) == 1:
+            return 0
+        
+        print(f"批量保存失败，改为逐条保存 {len(rows)} 份报告")
+        saved = 0
+        for report, row in zip(saved_reports, rows):
+            if self._insert_report_rows([row]):
+                print(f"AI顾问报告已保存: {report.report_id}")
+                saved += 1
+            else:
+                print(f"保存AI顾问报告失败: {report.report_id}")
+        return saved
+    
     def get_report(self, report_id: str) -> Optional[Dict]:
-        """获取报告详情"""
+        """获取报告详情（命中进程内缓存时不查询数据库）"""
+        # 缓存中的报告含嵌套列表/字典，深拷贝后返回，调用方修改不会影响缓存
+        cached = self._report_cache.get(report_id)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        
+        conn = None
         try:
             conn = self.db_manager._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
             cursor.execute('''
                 SELECT * FROM ai_advisor_reports WHERE report_id = ?
@@ -864,8 +1585,7 @@ Based on this historical data, please generate a comprehensive progress assessme
             result = cursor.fetchone()
             
             if result:
-                columns = [description[0] for description in cursor.description]
-                report_data = dict(zip(columns, result))
+                report_data = dict(result)
                 
                 # 解析JSON字段
                 json_fields = ['treatment_recommendations', 'lifestyle_recommendations', 
@@ -874,11 +1594,12 @@ Based on this historical data, please generate a comprehensive progress assessme
                 for field in json_fields:
                     if report_data[field]:
                         try:
-                            report_data[field] = json.loads(report_data[field])
+                            report_data[field] = json_loads(report_data[field])
                         except json.JSONDecodeError:
                             pass
                 
-                return report_data
+                self._report_cache.put(report_id, report_data)
+                return copy.deepcopy(report_data)
             
             return None
             
@@ -889,97 +1610,134 @@ Based on this historical data, please generate a comprehensive progress assessme
             if conn:
                 conn.close()
     
-    def get_user_reports(self, user_id: str, report_type: Optional[str] = None, limit: int = 10) -> List[Dict]:
-        """获取用户的报告历史"""
+    def iter_user_reports(self, user_id: str, report_type: Optional[str] = None,
+                          limit: int = 10) -> Iterator[Dict]:
+        """逐条产出用户的报告历史
+        
+        迭代结束（或生成器被回收）时归还连接，数据库错误直接抛出。
+        """
+        conn = None
         try:
             conn = self.db_manager._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
-            query = '''
-                SELECT report_id, report_type, generated_at, confidence_score, processing_time
-                FROM ai_advisor_reports
-                WHERE user_id = ?
-            '''
-            params = [user_id]
-            
+            # 查询列名与返回字段一致
             if report_type:
-                query += ' AND report_type = ?'
-                params.append(report_type)
-            
-            query += ' ORDER BY generated_at DESC LIMIT ?'
-            params.append(limit)
-            
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-            
-            return [{
-                'report_id': row[0],
-                'report_type': row[1],
-                'generated_at': row[2],
-                'confidence_score': row[3],
-                'processing_time': row[4]
-            } for row in results]
+                cursor.execute(self._SQL_USER_REPORTS_BY_TYPE, (user_id, report_type, limit))
+            else:
+                cursor.execute(self._SQL_USER_REPORTS, (user_id, limit))
             
-        except sqlite3.Error as e:
-            print(f"获取用户报告历史失败: {e}")
-            return []
+            for row in cursor:
+                yield dict(row)
         finally:
             if conn:
                 conn.close()
+    
+    def get_user_reports(self, user_id: str, report_type: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        """获取用户的报告历史"""
+        try:
+            return list(self.iter_user_reports(user_id, report_type, limit))
+        except sqlite3.Error as e:
+            print(f"获取用户报告历史失败: {e}")
+            return []
 
 # 便捷功能函数
-def generate_quick_report(user_id: str, report_type: str = 'both') -> Dict:
-    """快速生成报告的便捷函数"""
-    db_manager = DatabaseManager()
-    analyzer = MDQAnalyzer(db_manager)
-    advisor = DeepSeekAdvisor(db_manager, analyzer)
-    
+def _generate_user_reports(advisor: DeepSeekAdvisor, analyzer: MDQAnalyzer, user_id: str,
+                           report_type: str = 'both', pending_saves: Optional[List] = None) -> Dict:
+    """用已有的顾问实例为单个用户生成报告，返回报告摘要字典"""
     results = {}
+    single_report = historical_report = None
+    
+    if report_type in ['single', 'both']:
+        # 获取最新分析ID
+        analysis_history = analyzer.get_analysis_history(user_id, limit=1)
+        if analysis_history:
+            analysis_id = analysis_history[0]['analysis_id']
+            if report_type == 'both':
+                # 两份报告并发生成
+                single_report, historical_report = asyncio.run(
+                    advisor.agenerate_full_report(user_id, analysis_id, pending_saves))
+                # 成功的一份已加入待保存列表，失败的异常照常抛出
+                for report in (single_report, historical_report):
+                    if isinstance(report, Exception):
+                        raise report
+            else:
+                single_report = advisor.generate_single_test_report(analysis_id, pending_saves)
+    
+    if report_type in ['historical', 'both'] and historical_report is None:
+        historical_report = advisor.generate_historical_analysis_report(user_id, pending_saves)
+    
+    if single_report is not None:
+        results['single_test_report'] = {
+            'report_id': single_report.report_id,
+            'executive_summary': single_report.executive_summary,
+            'treatment_recommendations': single_report.treatment_recommendations,
+            'emergency_protocols': single_report.emergency_protocols
+        }
+    
+    if historical_report is not None:
+        results['historical_report'] = {
+            'report_id': historical_report.report_id,
+            'progress_analysis': historical_report.progress_analysis,
+            'trend_interpretation': historical_report.trend_interpretation,
+            'prognosis_assessment': historical_report.prognosis_assessment
+        }
+    
+    return results
+
+# 便捷函数共享的顾问实例（首次使用时创建，可跨线程使用）
+_default_advisor = None
+_default_advisor_lock = threading.Lock()
+
+def _get_default_advisor() -> DeepSeekAdvisor:
+    """返回共享的顾问实例，避免每次调用都重新初始化数据库与分析器"""
+    global _default_advisor
+    if _default_advisor is None:
+        with _default_advisor_lock:
+            if _default_advisor is None:
+                db_manager = DatabaseManager()
+                analyzer = MDQAnalyzer(db_manager)
+                _default_advisor = DeepSeekAdvisor(db_manager, analyzer)
+    return _default_advisor
+
+def generate_quick_report(user_id: str, report_type: str = 'both') -> Dict:
+    """快速生成报告的便捷函数（使用共享的顾问实例）"""
+    advisor = _get_default_advisor()
     
     try:
-        if report_type in ['single', 'both']:
-            # 获取最新分析ID
-            analysis_history = analyzer.get_analysis_history(user_id, limit=1)
-            if analysis_history:
-                analysis_id = analysis_history[0]['analysis_id']
-                single_report = advisor.generate_single_test_report(analysis_id)
-                results['single_test_report'] = {
-                    'report_id': single_report.report_id,
-                    'executive_summary': single_report.executive_summary,
-                    'treatment_recommendations': single_report.treatment_recommendations,
-                    'emergency_protocols': single_report.emergency_protocols
-                }
-        
-        if report_type in ['historical', 'both']:
-            historical_report = advisor.generate_historical_analysis_report(user_id)
-            results['historical_report'] = {
-                'report_id': historical_report.report_id,
-                'progress_analysis': historical_report.progress_analysis,
-                'trend_interpretation': historical_report.trend_interpretation,
-                'prognosis_assessment': historical_report.prognosis_assessment
-            }
-        
+        results = _generate_user_reports(advisor, advisor.analyzer, user_id, report_type)
         return {'success': True, 'reports': results}
         
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
-def batch_generate_reports(report_type: str = 'both') -> Dict:
-    """批量为所有用户生成报告"""
+def batch_generate_reports(report_type: str = 'both', max_workers: int = ADVISOR_WORKERS,
+                           user_ids: Optional[List[str]] = None) -> Dict:
+    """批量为用户生成报告
+    
+    user_ids 为空时为所有有分析记录的用户生成。所有用户共享同一个顾问实例，
+    由线程池并发生成（API等待期间释放GIL，每个工作线程使用各自的数据库连接，
+    单个请求的重试等待不会阻塞其他用户），生成的报告在最后一个事务内批量写入。
+    """
     db_manager = DatabaseManager()
     analyzer = MDQAnalyzer(db_manager)
     advisor = DeepSeekAdvisor(db_manager, analyzer)
     
+    conn = None
     try:
-        conn = db_manager._get_connection()
-        cursor = conn.cursor()
-        
-        # 获取所有有分析记录的用户
-        cursor.execute('''
-            SELECT DISTINCT user_id FROM mdq_analysis_results
-        ''')
-        
-        user_ids = [row[0] for row in cursor.fetchall()]
+        if user_ids is None:
+            conn = db_manager._get_connection()
+            cursor = conn.cursor()
+            
+            # 获取所有有分析记录的用户
+            cursor.execute('''
+                SELECT DISTINCT user_id FROM mdq_analysis_results
+            ''')
+            
+            user_ids = [row[0] for row in cursor.fetchall()]
+            conn.close()
+            conn = None
         
         results = {
             'total_users': len(user_ids),
@@ -987,21 +1745,28 @@ def batch_generate_reports(report_type: str = 'both') -> Dict:
             'failed_reports': 0,
             'reports': {}
         }
+        pending_saves = []
         
-        for user_id in user_ids:
-            try:
-                user_results = generate_quick_report(user_id, report_type)
-                if user_results['success']:
-                    results['successful_reports'] += 1
-                    results['reports'][user_id] = user_results['reports']
-                else:
-                    results['failed_reports'] += 1
-                    print(f"用户 {user_id[:8]} 报告生成失败: {user_results['error']}")
-                    
-            except Exception as e:
-                results['failed_reports'] += 1
-                print(f"用户 {user_id[:8]} 报告生成出错: {e}")
+        if user_ids:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(user_ids))) as executor:
+                futures = [
+                    executor.submit(_generate_user_reports, advisor, analyzer, user_id, report_type, pending_saves)
+                    for user_id in user_ids
+                ]
+                
+                # 按用户顺序汇总结果
+                for user_id, future in zip(user_ids, futures):
+                    try:
+                        results['reports'][user_id] = future.result()
+                        results['successful_reports'] += 1
+                        
+                    except Exception as e:
+                        results['failed_reports'] += 1
+                        print(f"用户 {user_id[:8]} 报告生成失败: {e}")
         
+        results['saved_reports'] = advisor.save_reports_bulk(pending_saves)
+        if results['saved_reports'] < len(pending_saves):
+            print(f"有 {len(pending_saves) - results['saved_reports']} 份报告保存失败")
         return results
         
     except Exception as e:
@@ -1012,87 +1777,93 @@ def batch_generate_reports(report_type: str = 'both') -> Dict:
             conn.close()
 
 # 报告格式化和导出功能
+# 报告类型显示名称
+_REPORT_TYPE_NAMES = {
+    'single_test': '单次测试分析报告',
+    'historical_analysis': '历史趋势分析报告'
+}
+
 def format_report_for_display(report_data: Dict) -> str:
     """格式化报告用于显示"""
     if not report_data:
         return "报告不存在"
     
-    report_type_names = {
-        'single_test': '单次测试分析报告',
-        'historical_analysis': '历史趋势分析报告'
-    }
+    report_type = report_data['report_type']
     
-    formatted_text = f"""
-# {report_type_names.get(report_data['report_type'], '分析报告')}
-
-**报告ID:** {report_data['report_id']}
-**生成时间:** {report_data['generated_at'][:19]}
-**AI模型:** {report_data['ai_model_version']}
-**置信度:** {report_data['confidence_score']:.2f}
-**处理时间:** {report_data['processing_time']:.2f}秒
-
----
-
-## 📋 执行摘要
-{report_data['executive_summary']}
-
-## 🏥 临床评估
-{report_data['clinical_assessment']}
-
-## ⚠️ 风险评估
-{report_data['risk_evaluation']}
-
-## 💊 治疗建议
-"""
+    # 逐行收集，最后一次性拼接
+    lines = [
+        '',
+        f"# {_REPORT_TYPE_NAMES.get(report_type, '分析报告')}",
+        '',
+        f"**报告ID:** {report_data['report_id']}",
+        f"**生成时间:** {report_data['generated_at'][:19]}",
+        f"**AI模型:** {report_data['ai_model_version']}",
+        f"**置信度:** {report_data['confidence_score']:.2f}",
+        f"**处理时间:** {report_data['processing_time']:.2f}秒",
+        '',
+        '---',
+        '',
+        '## 📋 执行摘要',
+        f"{report_data['executive_summary']}",
+        '',
+        '## 🏥 临床评估',
+        f"{report_data['clinical_assessment']}",
+        '',
+        '## ⚠️ 风险评估',
+        f"{report_data['risk_evaluation']}",
+        '',
+        '## 💊 治疗建议',
+    ]
     
     # 处理治疗建议
     treatment_recs = report_data['treatment_recommendations']
     if isinstance(treatment_recs, list):
-        for i, rec in enumerate(treatment_recs, 1):
-            formatted_text += f"{i}. {rec}\n"
+        lines.extend(f"{i}. {rec}" for i, rec in enumerate(treatment_recs, 1))
     else:
-        formatted_text += f"{treatment_recs}\n"
+        lines.append(f"{treatment_recs}")
     
-    formatted_text += "\n## 💡 生活方式建议\n"
+    lines += ['', '## 💡 生活方式建议']
     
     # 处理生活方式建议
     lifestyle_recs = report_data['lifestyle_recommendations']
     if isinstance(lifestyle_recs, list):
-        for i, rec in enumerate(lifestyle_recs, 1):
-            formatted_text += f"{i}. {rec}\n"
+        lines.extend(f"{i}. {rec}" for i, rec in enumerate(lifestyle_recs, 1))
     else:
-        formatted_text += f"{lifestyle_recs}\n"
+        lines.append(f"{lifestyle_recs}")
     
-    formatted_text += f"""
-## 📅 监测计划
-{report_data['monitoring_plan']}
-
-## 🚨 紧急预案
-{report_data['emergency_protocols']}
-"""
+    lines += [
+        '',
+        '## 📅 监测计划',
+        f"{report_data['monitoring_plan']}",
+        '',
+        '## 🚨 紧急预案',
+        f"{report_data['emergency_protocols']}",
+    ]
     
     # 如果是历史分析报告，添加额外内容
-    if report_data['report_type'] == 'historical_analysis':
-        formatted_text += f"""
----
-
-## 📈 进展分析
-{report_data['progress_analysis']}
-
-## 📊 趋势解读
-{report_data['trend_interpretation']}
-
-## 🔮 预后评估
-{report_data['prognosis_assessment']}
-"""
+    if report_type == 'historical_analysis':
+        lines += [
+            '',
+            '---',
+            '',
+            '## 📈 进展分析',
+            f"{report_data['progress_analysis']}",
+            '',
+            '## 📊 趋势解读',
+            f"{report_data['trend_interpretation']}",
+            '',
+            '## 🔮 预后评估',
+            f"{report_data['prognosis_assessment']}",
+        ]
     
-    return formatted_text
-
-def export_report_to_file(report_id: str, filename: Optional[str] = None) -> str:
-    """导出报告到文件"""
-    db_manager = DatabaseManager()
-    analyzer = MDQAnalyzer(db_manager)
-    advisor = DeepSeekAdvisor(db_manager, analyzer)
+    lines.append('')
+    return '\n'.join(lines)
+
+def export_report_to_file(report_id: str, filename: Optional[str] = None,
+                          advisor: Optional[DeepSeekAdvisor] = None) -> str:
+    """导出报告到文件（未传入 advisor 时使用共享实例）"""
+    if advisor is None:
+        advisor = _get_default_advisor()
     
     report = advisor.get_report(report_id)
     if not report:
@@ -1100,17 +1871,34 @@ def export_report_to_file(report_id: str, filename: Optional[str] = None) -> str
     
     if filename is None:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"mdq_report_{report_id[:8]}_{timestamp}.txt"
+        # UUIDv7 的前缀是时间戳，取末尾随机位区分同一时段生成的报告
+        filename = f"mdq_report_{report_id[-12:]}_{timestamp}.txt"
     
     formatted_text = format_report_for_display(report)
     
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(formatted_text)
+        # 一次编码后以二进制写入，跳过文本层的分块编码
+        with open(filename, 'wb') as f:
+            f.write(formatted_text.encode('utf-8'))
         return f"报告已导出到: {filename}"
     except Exception as e:
         return f"导出失败: {e}"
 
+def export_reports(report_ids: List[str], out_dir: str = '.', max_workers: int = 4) -> List[str]:
+    """批量导出报告，文件名为 mdq_report_<report_id>.txt
+    
+    共用一个顾问实例，文件写入由线程池并行执行；返回与 report_ids 顺序一致的结果信息。
+    """
+    advisor = _get_default_advisor()
+    os.makedirs(out_dir, exist_ok=True)
+    
+    def export_one(report_id: str) -> str:
+        filename = os.path.join(out_dir, f"mdq_report_{report_id}.txt")
+        return export_report_to_file(report_id, filename, advisor)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(export_one, report_ids))
+
 # 测试函数
 def test_deepseek_advisor():
     """测试DeepSeek AI顾问功能"""
@@ -1243,7 +2031,6 @@ def test_deepseek_advisor():
         
     except Exception as e:
         print(f"❌ 测试过程出错: {e}")
-        import traceback
         traceback.print_exc()
         
     finally:
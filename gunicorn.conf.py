@@ -11,7 +11,9 @@ backlog = 2048
 
 # Worker processes
 workers = int(os.getenv('WORKERS', '2'))
-worker_class = 'sync'
+# Threaded workers keep serving other requests while one waits on the DeepSeek API
+worker_class = 'gthread'
+threads = int(os.getenv('THREADS', '16'))
 worker_connections = 1000
 timeout = 180  # 3 minutes timeout for long-running AI requests
 keepalive = 5
@@ -5,11 +5,22 @@ MindCare 心理健康评估系统启动脚本
 import os
 import sys
 import subprocess
+import importlib.util
 import platform
 import webbrowser
 import time
+import socket
+import threading
+import traceback
+import re
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    from importlib.metadata import PackageNotFoundError, version as metadata_version
+except ImportError:  # Python 3.7
+    metadata_version = None
+
 def check_python_version():
     """检查Python版本"""
     if sys.version_info < (3, 7):
@@ -18,6 +29,26 @@ def check_python_version():
         return False
     return True
 
+def _version_tuple(version_text):
+    """取版本号开头的数字部分用于比较，如 '2.3.1rc1' -> (2, 3, 1)"""
+    match = re.match(r'\d+(?:\.\d+)*', version_text)
+    return tuple(int(part) for part in match.group().split('.')) if match else ()
+
+def _requirement_missing(requirement):
+    """判断依赖是否缺失或版本过低
+    
+    从已安装包的元数据读取版本，不执行包的导入代码；
+    Python 3.7 没有 importlib.metadata，只检查模块是否存在。
+    """
+    name, _, min_version = requirement.partition('>=')
+    if metadata_version is None:
+        return importlib.util.find_spec(name.replace('-', '_')) is None
+    try:
+        installed_version = metadata_version(name)
+    except PackageNotFoundError:
+        return True
+    return _version_tuple(installed_version) < _version_tuple(min_version)
+
 def install_requirements():
     """安装依赖包"""
     requirements = [
@@ -29,12 +60,12 @@ def install_requirements():
     ]
     
     print("📦 检查并安装依赖包...")
-    for requirement in requirements:
-        try:
-            __import__(requirement.split('>=')[0].replace('-', '_'))
-        except ImportError:
-            print(f"安装 {requirement}...")
-            subprocess.check_call([sys.executable, '-m', 'pip', 'install', requirement])
+    missing = [requirement for requirement in requirements if _requirement_missing(requirement)]
+    
+    # 缺失的包一次性安装，由pip统一解析依赖
+    if missing:
+        print(f"安装 {' '.join(missing)}...")
+        subprocess.check_call([sys.executable, '-m', 'pip', 'install', *missing])
 
 def check_files():
     """检查必要文件是否存在"""
@@ -105,7 +136,6 @@ def init_database():
         return True
     except Exception as e:
         print(f"❌ 数据库初始化失败: {e}")
-        import traceback
         traceback.print_exc()
         return False
 
@@ -145,21 +175,23 @@ def create_test_users(db_manager):
     print(f"✅ 测试用户准备完成 ({created_count} 个新用户)")
 
 def check_api_key():
-    """检查API密钥配置"""
+    """检查API密钥配置（读取模块中实际生效的密钥，含环境变量覆盖）"""
     try:
-        with open('gptadvisor.py', 'r', encoding='utf-8') as f:
-            content = f.read()
-            if 'your_deepseek_api_key_here' in content:
-                print("⚠️  警告: DeepSeek API密钥未配置")
-                print("   AI功能将不可用，请在 gptadvisor.py 中设置正确的API密钥")
-                return False
-    except:
-        pass
+        from gptadvisor import DEEPSEEK_API_KEY
+    except Exception as e:
+        print(f"⚠️  警告: 无法加载 gptadvisor 模块: {e}")
+        print("   AI功能将不可用")
+        return False
+    
+    if not DEEPSEEK_API_KEY or DEEPSEEK_API_KEY == 'your_deepseek_api_key_here':
+        print("⚠️  警告: DeepSeek API密钥未配置")
+        print("   AI功能将不可用，请在 gptadvisor.py 中设置正确的API密钥")
+        return False
     return True
 
+@lru_cache(maxsize=1)
 def get_local_ip():
-    """获取本机IP地址"""
-    import socket
+    """获取本机IP地址（进程内只探测一次）"""
     try:
         # 连接到外部地址来获取本机IP
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -249,7 +281,6 @@ def main():
             time.sleep(2)
             webbrowser.open('http://localhost:5000')
         
-        import threading
         threading.Thread(target=open_browser, daemon=True).start()
         
         # 启动应用